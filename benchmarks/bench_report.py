@@ -0,0 +1,227 @@
+"""Benchmark of the report pipeline on a synthetic organization.
+
+The stage times are compared as ratios to the time of a fixed
+pure python workload measured in the same run, so the baseline
+doesn't depend on the speed of the machine. The memory peaks
+are compared as they are.
+
+Usage:
+    python -m benchmarks.bench_report --users 2000 --projects 1000
+    python -m benchmarks.bench_report --save-baseline
+"""
+import os
+import sys
+import argparse
+import datetime
+import json
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rtbot34 import (  # noqa: E402
+    ACTIVITIES_PAGE_SIZE, ActivityCache, Command)
+
+
+BASELINE_FILENAME = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_TOLERANCE = 1.5
+REFERENCE_PASSES = 10
+
+
+class SyntheticClient:
+    """Hubstaff client stub serving a generated organization."""
+
+    def __init__(self, users, projects, activities, seed=34):
+        rnd = random.Random(seed)
+        projects_ids = list(range(1, projects + 1))
+        self.users_list = [
+            {'id': user_id, 'name': 'User %s' % user_id, 'projects': [
+                {'id': project_id, 'name': 'Project %s' % project_id}
+                for project_id in rnd.sample(
+                    projects_ids, min(projects, 5))
+            ]}
+            for user_id in range(1, users + 1)
+        ]
+        self.activities_list = [
+            {'id': activity_id,
+             'user_id': user_item['id'],
+             'project_id': rnd.choice(user_item['projects'])['id'],
+             'tracked': rnd.randint(1, 600),
+             'starts_at': '2001-02-03T%02d:%02d:00Z' % (
+                 activity_id // 6 % 24, activity_id % 6 * 10)}
+            for activity_id, user_item in enumerate(
+                rnd.choice(self.users_list) for _ in range(activities))
+        ]
+
+    def authenticate(self):
+        return 'B' * 43
+
+    def get_users_list(self, include_projects=False):
+        return self.users_list
+
+    def get_activities_list(self, date_from, date_to, offset=0):
+        return self.activities_list[offset:offset + ACTIVITIES_PAGE_SIZE]
+
+
+def make_command(client, dirname, concurrency=4):
+    command = Command(config_filename=os.path.join(dirname, 'rc'))
+    config = command._config
+    config.hubstaff_concurrency = concurrency
+    config.report_filename = os.path.join(dirname, 'report.html')
+    config.report_cache_dirname = os.path.join(dirname, 'cache')
+    config.report_incremental = False
+    command._cache = ActivityCache(
+        dirname=config.report_cache_dirname, namespace='bench')
+    command._hubstaff = client
+    return command
+
+
+def measure(func, trace_memory):
+    """Returns the result, wall time and peak of allocated memory."""
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = func()
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run_stages(client, days, trace_memory):
+    date_from = datetime.date(2001, 2, 3)
+    date_to = date_from + datetime.timedelta(days=days)
+    dirname = tempfile.mkdtemp(prefix='rtbot34bench')
+    try:
+        command = make_command(client, dirname)
+        results = {}
+        data, results['get_report_data'], peak = measure(
+            lambda: command._get_report_data(date_from, date_to),
+            trace_memory)
+        results['get_report_data_peak'] = peak
+        _, results['get_report_data_cached'], peak = measure(
+            lambda: command._get_report_data(date_from, date_to),
+            trace_memory)
+        results['get_report_data_cached_peak'] = peak
+        _, results['render_report_to_html'], peak = measure(
+            lambda: command._render_report_to_html(data=data),
+            trace_memory)
+        results['render_report_to_html_peak'] = peak
+        _, results['save_report_html_to_file'], peak = measure(
+            lambda: command._save_report_html_to_file(
+                html=command._render_report_to_html(data=data, stream=True),
+                filename=command._config.report_filename),
+            trace_memory)
+        results['save_report_html_to_file_peak'] = peak
+        return results
+    finally:
+        shutil.rmtree(dirname)
+
+
+def run_reference(client):
+    """The fixed workload which the stage times are relative to:
+    it sums the tracked time of the activities by user and project.
+    """
+    totals = {}
+    # a few passes make it long enough to be timed steadily
+    for item in client.activities_list * REFERENCE_PASSES:
+        key = (item['user_id'], item['project_id'])
+        totals[key] = totals.get(key, 0) + item['tracked']
+    return json.dumps(sorted(totals.items()))
+
+
+def run(users, projects, activities, days, repeat):
+    """Times every stage and the reference workload (the best of
+    repeat runs), then measures the memory peaks in a separate traced run.
+    Returns the results and the reference time.
+    """
+    client = SyntheticClient(users, projects, activities)
+    results = {}
+    reference = None
+    for _ in range(repeat):
+        for key, value in run_stages(client, days, False).items():
+            if value is not None:
+                results[key] = min(results.get(key, value), value)
+        _, seconds, _ = measure(lambda: run_reference(client), False)
+        reference = min(reference or seconds, seconds)
+    for key, value in run_stages(client, days, True).items():
+        if key.endswith('_peak'):
+            results[key] = value
+    return results, reference
+
+
+def to_relative(results, reference):
+    """Stage times become ratios to the reference time."""
+    return {key: value if key.endswith('_peak') else value / reference
+            for key, value in results.items()}
+
+
+def compare(results, baseline, tolerance):
+    """Returns the list of the stages which became slower or bigger."""
+    regressions = []
+    for key, value in sorted(results.items()):
+        base_value = baseline.get(key)
+        if base_value and value > base_value * tolerance:
+            regressions.append((key, base_value, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the rt-bot-34 report pipeline.')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--activities', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed ratio to the baseline values. '
+                             'Default: %s' % DEFAULT_TOLERANCE)
+    parser.add_argument('--baseline', default=BASELINE_FILENAME)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline.')
+    args = parser.parse_args(argv)
+
+    key = '%s users, %s projects, %s activities, %s days' % (
+        args.users, args.projects, args.activities, args.days)
+    results, reference = run(args.users, args.projects, args.activities,
+                             args.days, args.repeat)
+    print('%-36s %10.4f s' % ('reference', reference))
+    for name, value in sorted(results.items()):
+        if name.endswith('_peak'):
+            print('%-36s %10.1f KiB' % (name, value / 1024))
+        else:
+            print('%-36s %10.4f s %8.2f x' % (
+                name, value, value / reference))
+    results = to_relative(results, reference)
+
+    try:
+        with open(args.baseline, 'r') as f:
+            baselines = json.load(f)
+    except IOError:
+        baselines = {}
+
+    if args.save_baseline:
+        baselines[key] = results
+        with open(args.baseline, 'w+') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+
+    if key not in baselines:
+        print('no baseline for: %s' % key)
+        return 0
+    regressions = compare(results, baselines[key], args.tolerance)
+    for name, base_value, value in regressions:
+        print('regression: %s %s -> %s' % (name, base_value, value))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,173 @@
 import os
 import argparse
+import contextlib
+import functools
 import getpass
+import collections
 import configparser
+import csv
 import datetime
+import gzip
+import hashlib
+import importlib
+import io
+import itertools
+import json
 import logging
-from collections import defaultdict
+import operator
+import queue
+import random
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
 
-import jinja2
-import marshmallow as ma
-from marshmallow import validate as vld
-from hubstaff.client_v1 import HubstaffClient
-from hubstaff.exceptions import HubstaffAuthError
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # brotli compression is optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # no file locks on this platform
 
 
 DEFAULT_CONFIG_FILENAME = '~/.rtbot34rc'
 DEFAULT_REPORT_FILENAME = '~/rtbot34.html'
+DEFAULT_REPORT_FORMATS = 'html'
+DEFAULT_REPORT_SORT = 'name'
+REPORT_SORTS = ('name', 'total')
+DEFAULT_CACHE_DIRNAME = '~/.rtbot34cache'
+DEFAULT_DAEMON_AT = '00:10'
+DEFAULT_DIRECTORY_TTL = 24 * 60 * 60
+DEFAULT_EMAIL_PORT = 25
+# hubstaff returns at most that many activities per request
+ACTIVITIES_PAGE_SIZE = 500
+WRITE_BUFFER_SIZE = 64 * 1024
+# smaller batches of activities are aggregated without numpy
+NUMPY_MIN_BATCH_SIZE = 2 * 1024
+NUMPY_MAX_BATCH_SIZE = 16 * 1024
+
+# heavy dependencies are imported on the first use,
+# so the cli help and health checks start fast
+LAZY_IMPORTS = {
+    'asyncio': ('asyncio', None),
+    'parsedate_to_datetime': ('email.utils', 'parsedate_to_datetime'),
+    'smtplib': ('smtplib', None),
+    'sqlite3': ('sqlite3', None),
+    'cProfile': ('cProfile', None),
+    'tracemalloc': ('tracemalloc', None),
+    'EmailMessage': ('email.message', 'EmailMessage'),
+    'ProcessPoolExecutor': ('concurrent.futures', 'ProcessPoolExecutor'),
+    'ThreadPoolExecutor': ('concurrent.futures', 'ThreadPoolExecutor'),
+    'jinja2': ('jinja2', None),
+    'ma': ('marshmallow', None),
+    'vld': ('marshmallow.validate', None),
+    'HubstaffClient': ('hubstaff.client_v1', 'HubstaffClient'),
+    'HubstaffAuthError': ('hubstaff.exceptions', 'HubstaffAuthError'),
+}
+
+
+def _lazy_import(name):
+    """Returns the lazy dependency, it's imported once
+    and kept in the module globals (where tests can patch it).
+    """
+    value = globals().get(name)
+    if value is None:
+        module_name, attr_name = LAZY_IMPORTS[name]
+        value = importlib.import_module(module_name)
+        if attr_name:
+            value = getattr(value, attr_name)
+        globals()[name] = value
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def get_numpy():
+    """Returns numpy module or None if it isn't installed,
+    numpy is optional and heavy, so it's imported on the first use.
+    """
+    try:
+        return importlib.import_module('numpy')
+    except ImportError:
+        return None
+
+
+def __getattr__(name):
+    if name in LAZY_IMPORTS:
+        return _lazy_import(name)
+    if name.endswith('SectionSchema'):
+        for schema in get_section_schemas().values():
+            if schema.__name__ == name:
+                return schema
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+REPORT_HTML_TEMPLATE = '''<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" lang="en">
+  <head>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>rt-bot-34 report {{ date_from }} - {{ date_to }}</title>
+  </head>
+  <body>
+    <h1>{{ date_from }} - {{ date_to }}</h1>
+    <table>
+      <thead>
+        <tr>
+          <th>&nbsp;</th>
+        {% for user_id in table.users_ids %}
+          <th>{{ users[user_id].name }}</th>
+        {% endfor %}
+          <th>Total</th>
+        </tr>
+      </thead>
+      <tbody>
+      {% for project_id, cells, total in table.rows %}
+        <tr>
+          <td>{{ projects[project_id].name }}</td>
+        {% for seconds in cells %}
+          <td>{{ seconds }}</td>
+        {% endfor %}
+          <td>{{ total }}</td>
+        </tr>
+      {% endfor %}
+      </tbody>
+      <tfoot>
+        <tr>
+          <td>Total</td>
+        {% for seconds in table.totals %}
+          <td>{{ seconds }}</td>
+        {% endfor %}
+          <td>{{ table.total }}</td>
+        </tr>
+      </tfoot>
+    </table>
+  </body>
+</html>
+'''
+
+
+@functools.lru_cache(maxsize=None)
+def _get_jinja_env():
+    jinja2 = _lazy_import('jinja2')
+    return jinja2.Environment(
+        loader=jinja2.DictLoader({
+            'report.html': REPORT_HTML_TEMPLATE,
+        }))
+
+
+def get_template(name):
+    """Returns the compiled template, the environment compiles
+    each template once and keeps it in its cache.
+    """
+    return _get_jinja_env().get_template(name)
 
 
 def normalize_path(path, default=None):
@@ -29,42 +182,401 @@ def normalize_path(path, default=None):
     return path
 
 
-class HubstaffSectionSchema(ma.Schema):
-    hubstaff_app_token = ma.fields.String(
-        load_from='app_token', dump_to='app_token',
-        required=True, validate=vld.Length(min=43, max=43))
-    hubstaff_auth_token = ma.fields.String(
-        load_from='auth_token', dump_to='auth_token',
-        allow_none=True, validate=vld.Length(min=43, max=43))
-    hubstaff_username = ma.fields.Email(
-        load_from='username', dump_to='username',
-        allow_none=True, validate=vld.Length(min=1, max=255))
-    hubstaff_password = ma.fields.String(
-        load_from='password', dump_to='password',
-        allow_none=True, validate=vld.Length(min=1, max=255))
-
-    class Meta:
-        ordered = True
-
-
-class ReportSectionSchema(ma.Schema):
-    report_filename = ma.fields.String(
-        load_from='html_file', dump_to='html_file',
-        required=True, missing=DEFAULT_REPORT_FILENAME,
-        validate=vld.Length(min=1, max=255))
-    report_date = ma.fields.Date(
-        load_from='date', dump_to='date', format='%Y-%m-%d')
-    report_days_ago = ma.fields.Integer(
-        load_from='days_ago', dump_to='days_ago', as_string=True,
-        required=True, missing=1, validate=vld.Range(min=0, max=7))
-
-    class Meta:
-        ordered = True
-
-    @ma.post_load(pass_many=False)
-    def load_report_filename(self, data):
-        data['report_filename'] = normalize_path(data['report_filename'])
-        return data
+@contextlib.contextmanager
+def file_lock(filename):
+    """Holds the exclusive lock of the directory of the filename
+    to serialize the writers of the filename among the processes.
+    The file itself can't be locked, it's replaced on write.
+    """
+    fd = os.open(os.path.dirname(filename), os.O_RDONLY)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # the lock is released with the closed fd
+
+
+@functools.lru_cache(maxsize=None)
+def _get_umask():
+    """The umask can be read only by setting it,
+    so it's read once, before the writer threads start.
+    """
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def _join_chunks(chunks, binary=False):
+    """Joins the small chunks into blocks of WRITE_BUFFER_SIZE bytes."""
+    block = bytearray()
+    for chunk in chunks:
+        block += chunk if binary else chunk.encode('utf-8')
+        if len(block) >= WRITE_BUFFER_SIZE:
+            yield block  # it's written before the next block is joined
+            block.clear()
+    if block:
+        yield block
+
+
+def _copy_blocks(source, files, size=None):
+    """Writes size bytes (or the rest) of the source file into the files."""
+    while size is None or size > 0:
+        block = source.read(WRITE_BUFFER_SIZE if size is None else
+                            min(size, WRITE_BUFFER_SIZE))
+        if not block:
+            break
+        for f in files:
+            f.write(block)
+        if size is not None:
+            size -= len(block)
+
+
+class _BrotliCompressor:
+    """Brotli compressor with the same interface as zlib one."""
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=9)
+
+    def compress(self, data):
+        return self._compressor.process(bytes(data))
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+# encodings of the compressed copies: file extension, compressor factory
+COMPRESSORS = {
+    'gzip': ('.gz', lambda: zlib.compressobj(9, zlib.DEFLATED, 31)),
+    'brotli': ('.br', _BrotliCompressor),
+}
+
+
+def _get_compressors(compress):
+    """Returns the extensions and the compressor factories
+    of the encodings which can be written.
+    """
+    compressors = []
+    for encoding in compress:
+        if encoding == 'brotli' and brotli is None:
+            continue  # brotli isn't installed
+        compressors.append(COMPRESSORS[encoding])
+    return compressors
+
+
+def remove_stale_copies(filename, compress=()):
+    """Removes the compressed copies of the encodings which aren't written
+    anymore, so they can't be served instead of the changed file.
+    """
+    extensions = {extension for extension, _ in _get_compressors(compress)}
+    for extension, _ in COMPRESSORS.values():
+        if extension not in extensions and os.path.exists(
+                filename + extension):
+            os.remove(filename + extension)
+
+
+class _AtomicFile:
+    """Temp file in the directory of the target file,
+    it replaces the target file on commit.
+    """
+
+    def __init__(self, filename, compressor=None):
+        self.filename = filename
+        fd, self.tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(filename), suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self._compressor = compressor
+
+    def write(self, block):
+        if self._compressor is not None:
+            block = self._compressor.compress(block)
+        self._file.write(block)
+
+    def close(self):
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def commit(self, mode):
+        os.chmod(self.tmp_filename, mode)
+        os.replace(self.tmp_filename, self.filename)
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.tmp_filename):
+            os.remove(self.tmp_filename)
+
+
+def atomic_write(filename, chunks, binary=False, compress=(), mode=None):
+    """Writes the chunks into the temp file in the same directory
+    and renames it to the filename, so readers never see a partial file.
+    Small chunks are joined into bigger blocks before writing.
+    Compressed copies (e.g. filename.gz) of the given encodings
+    are written from the same blocks on the way.
+    The blocks are compared with the current file first, the temp files
+    appear only from the first difference, so the same content
+    isn't written, compressed nor synced again.
+    A new file gets the mode or the default one of the umask,
+    a replaced file keeps its mode.
+    Returns True if the file is changed.
+    """
+    copies = _get_compressors(compress)
+    try:
+        current_file = open(filename, 'rb')
+        mode = stat.S_IMODE(os.fstat(current_file.fileno()).st_mode)
+    except OSError:
+        current_file = None  # file not found
+        if mode is None:
+            mode = 0o666 & ~_get_umask()
+    files = []
+    same_size = 0  # size of the content which is the same as the current
+
+    def open_files():
+        files.append(_AtomicFile(filename))
+        for extension, compressor_class in copies:
+            files.append(
+                _AtomicFile(filename + extension, compressor_class()))
+        # the same beginning is copied from the current file
+        if same_size:
+            current_file.seek(0)
+            _copy_blocks(current_file, files, same_size)
+
+    try:
+        for block in _join_chunks(chunks, binary):
+            if not files:
+                if (current_file is not None and
+                        current_file.read(len(block)) == block):
+                    same_size += len(block)
+                    continue
+                open_files()
+            for f in files:
+                f.write(block)
+
+        is_changed = bool(files) or current_file is None or bool(
+            current_file.read(1))
+        if not is_changed:
+            # the file isn't changed, only the missing copies are written
+            for extension, compressor_class in copies:
+                if os.path.exists(filename + extension):
+                    continue
+                files.append(
+                    _AtomicFile(filename + extension, compressor_class()))
+                current_file.seek(0)
+                _copy_blocks(current_file, files[-1:])
+                files[-1].close()
+                files[-1].commit(mode)
+            return False
+
+        if not files:
+            open_files()  # the content is new or cut short
+        for f in files:
+            f.close()
+        # compressed copies go first, they must be ready with the file
+        for f in files[1:] + files[:1]:
+            f.commit(mode)
+        return True
+    finally:
+        if current_file is not None:
+            current_file.close()
+        for f in files:
+            f.discard()
+
+
+@functools.lru_cache(maxsize=None)
+def get_section_schemas():
+    """Returns the schemas of the config sections,
+    they are declared on the first call to keep marshmallow import lazy.
+    """
+    ma = _lazy_import('ma')
+    vld = _lazy_import('vld')
+
+    class BooleanString(ma.fields.Boolean):
+        """Boolean field which is dumped as a string
+        like other config values.
+        """
+
+        def _serialize(self, value, attr, obj):
+            value = super()._serialize(value, attr, obj)
+            if value is None:
+                return None
+            return 'true' if value else 'false'
+
+    class HubstaffSectionSchema(ma.Schema):
+        hubstaff_app_token = ma.fields.String(
+            load_from='app_token', dump_to='app_token',
+            required=True, validate=vld.Length(min=43, max=43))
+        hubstaff_auth_token = ma.fields.String(
+            load_from='auth_token', dump_to='auth_token',
+            allow_none=True, validate=vld.Length(min=43, max=43))
+        hubstaff_username = ma.fields.Email(
+            load_from='username', dump_to='username',
+            allow_none=True, validate=vld.Length(min=1, max=255))
+        hubstaff_password = ma.fields.String(
+            load_from='password', dump_to='password',
+            allow_none=True, validate=vld.Length(min=1, max=255))
+        hubstaff_concurrency = ma.fields.Integer(
+            load_from='concurrency', dump_to='concurrency', as_string=True,
+            required=True, missing=4, validate=vld.Range(min=1, max=32))
+        hubstaff_rate_limit = ma.fields.Float(
+            load_from='rate_limit', dump_to='rate_limit', as_string=True,
+            required=True, missing=5.0, validate=vld.Range(min=0.01, max=1000))
+        hubstaff_retries = ma.fields.Integer(
+            load_from='retries', dump_to='retries', as_string=True,
+            required=True, missing=5, validate=vld.Range(min=0, max=20))
+        hubstaff_directory_ttl = ma.fields.Integer(
+            load_from='directory_ttl', dump_to='directory_ttl', as_string=True,
+            required=True, missing=DEFAULT_DIRECTORY_TTL,
+            validate=vld.Range(min=0))
+
+        class Meta:
+            ordered = True
+
+    class ReportSectionSchema(ma.Schema):
+        report_filename = ma.fields.String(
+            load_from='html_file', dump_to='html_file',
+            required=True, missing=DEFAULT_REPORT_FILENAME,
+            validate=vld.Length(min=1, max=255))
+        report_date = ma.fields.Date(
+            load_from='date', dump_to='date', format='%Y-%m-%d')
+        # the range end is given per run, it's never kept in the file
+        report_date_end = ma.fields.Date(
+            load_from='date_to', format='%Y-%m-%d', load_only=True)
+        report_days_ago = ma.fields.Integer(
+            load_from='days_ago', dump_to='days_ago', as_string=True,
+            required=True, missing=1, validate=vld.Range(min=0, max=7))
+        report_cache_dirname = ma.fields.String(
+            load_from='cache_dir', dump_to='cache_dir',
+            required=True, missing=DEFAULT_CACHE_DIRNAME,
+            validate=vld.Length(min=1, max=255))
+        report_incremental = BooleanString(
+            load_from='incremental', dump_to='incremental',
+            required=True, missing=False)
+        report_stats_filename = ma.fields.String(
+            load_from='stats_file', dump_to='stats_file',
+            allow_none=True, validate=vld.Length(min=1, max=255))
+        report_formats = ma.fields.String(
+            load_from='formats', dump_to='formats',
+            required=True, missing=DEFAULT_REPORT_FORMATS,
+            validate=vld.Length(min=1, max=255))
+        report_compress = ma.fields.String(
+            load_from='compress', dump_to='compress',
+            allow_none=True, validate=vld.Length(min=1, max=255))
+        report_sort = ma.fields.String(
+            load_from='sort', dump_to='sort',
+            required=True, missing=DEFAULT_REPORT_SORT,
+            validate=vld.OneOf(REPORT_SORTS))
+
+        class Meta:
+            ordered = True
+
+        @ma.validates_schema(pass_many=False)
+        def validate_report_date_end(self, data):
+            date_from = data.get('report_date')
+            date_end = data.get('report_date_end')
+            if date_end and not date_from:
+                raise ma.ValidationError(
+                    'Date range end requires the range start.',
+                    ['report_date_end'])
+            if date_end and date_end < date_from:
+                raise ma.ValidationError(
+                    'Date range end must not be before its start.',
+                    ['report_date_end'])
+
+        @ma.validates('report_formats')
+        def validate_report_formats(self, value):
+            for report_format in value.split(','):
+                if report_format.strip() not in REPORT_EXPORTERS:
+                    raise ma.ValidationError(
+                        'Unknown report format: %s.' % report_format)
+
+        @ma.validates('report_compress')
+        def validate_report_compress(self, value):
+            for encoding in value.split(','):
+                if encoding.strip() not in COMPRESSORS:
+                    raise ma.ValidationError(
+                        'Unknown compression: %s.' % encoding)
+
+        @ma.post_load(pass_many=False)
+        def load_report_filename(self, data):
+            data['report_filename'] = normalize_path(data['report_filename'])
+            return data
+
+        @ma.post_load(pass_many=False)
+        def load_report_cache_dirname(self, data):
+            data['report_cache_dirname'] = normalize_path(
+                data['report_cache_dirname'])
+            return data
+
+        @ma.post_load(pass_many=False)
+        def load_report_stats_filename(self, data):
+            data['report_stats_filename'] = normalize_path(
+                data.get('report_stats_filename'))
+            return data
+
+    class DaemonSectionSchema(ma.Schema):
+        daemon_interval = ma.fields.Integer(
+            load_from='interval', dump_to='interval', as_string=True,
+            allow_none=True, validate=vld.Range(min=1, max=24 * 60))
+        daemon_at = ma.fields.String(
+            load_from='at', dump_to='at',
+            required=True, missing=DEFAULT_DAEMON_AT,
+            validate=vld.Regexp(r'^([01][0-9]|2[0-3]):[0-5][0-9]$'))
+
+        class Meta:
+            ordered = True
+
+    class EmailSectionSchema(ma.Schema):
+        email_host = ma.fields.String(
+            load_from='host', dump_to='host',
+            allow_none=True, validate=vld.Length(min=1, max=255))
+        email_port = ma.fields.Integer(
+            load_from='port', dump_to='port', as_string=True,
+            required=True, missing=DEFAULT_EMAIL_PORT,
+            validate=vld.Range(min=1, max=65535))
+        email_username = ma.fields.String(
+            load_from='username', dump_to='username',
+            allow_none=True, validate=vld.Length(min=1, max=255))
+        email_password = ma.fields.String(
+            load_from='password', dump_to='password',
+            allow_none=True, validate=vld.Length(min=1, max=255))
+        email_starttls = BooleanString(
+            load_from='starttls', dump_to='starttls',
+            required=True, missing=False)
+        email_from = ma.fields.Email(
+            load_from='from', dump_to='from',
+            allow_none=True, validate=vld.Length(min=1, max=255))
+        email_to = ma.fields.String(
+            load_from='to', dump_to='to',
+            allow_none=True, validate=vld.Length(min=1, max=1024))
+        email_attach_gzip = BooleanString(
+            load_from='attach_gzip', dump_to='attach_gzip',
+            required=True, missing=False)
+
+        class Meta:
+            ordered = True
+
+        @ma.validates('email_to')
+        def validate_email_to(self, value):
+            validate_email = vld.Email()
+            for recipient in value.split(','):
+                validate_email(recipient.strip())
+
+        @ma.validates_schema(pass_many=False)
+        def validate_email_from(self, data):
+            if (data.get('email_to') and not data.get('email_from') and
+                    not data.get('email_username')):
+                raise ma.ValidationError(
+                    'Report recipients require the sender address.',
+                    ['email_from'])
+
+    return {
+        'hubstaff': HubstaffSectionSchema,
+        'report': ReportSectionSchema,
+        'daemon': DaemonSectionSchema,
+        'email': EmailSectionSchema,
+    }
 
 
 class Config:
@@ -76,76 +588,222 @@ class Config:
     hubstaff_auth_token = None
     hubstaff_username = None
     hubstaff_password = None
+    hubstaff_concurrency = None
+    hubstaff_rate_limit = None
+    hubstaff_retries = None
+    hubstaff_directory_ttl = None
     report_filename = None
     report_date = None
+    report_date_end = None
     report_days_ago = None
+    report_cache_dirname = None
+    report_incremental = None
+    report_stats_filename = None
+    report_formats = None
+    report_compress = None
+    report_sort = None
+    daemon_interval = None
+    daemon_at = None
+    email_host = None
+    email_port = None
+    email_username = None
+    email_password = None
+    email_starttls = None
+    email_from = None
+    email_to = None
+    email_attach_gzip = None
 
     @property
     def sections(self):
-        sections = {
-            'hubstaff': HubstaffSectionSchema,
-            'report': ReportSectionSchema,
-        }
-        return sections
+        return get_section_schemas()
+
+    @classmethod
+    def list_profiles(cls, config_filename):
+        """Returns names of the profiles declared in the config file
+        as [hubstaff:<name>] or [report:<name>] sections.
+        """
+        config = configparser.ConfigParser()
+        config.read(normalize_path(
+            config_filename, default=DEFAULT_CONFIG_FILENAME))
+        profiles = []
+        for section_name in config.sections():
+            base_name, _, profile = section_name.partition(':')
+            if (base_name in ('hubstaff', 'report') and profile and
+                    profile not in profiles):
+                profiles.append(profile)
+        return profiles
+
+    def _get_section_name(self, section_name):
+        if self.profile:
+            return '%s:%s' % (section_name, self.profile)
+        return section_name
+
+    def _get_section_data(self, section_name):
+        """Values of the profile section fall back to the base section."""
+        sections_data = []
+        for name in (self._get_section_name(section_name), section_name):
+            try:
+                sections_data.append(self._config[name])
+            except (KeyError, configparser.NoSectionError):
+                pass
+        return collections.ChainMap(*sections_data)
+
+    def _add_profile_suffix(self, filename):
+        base_filename, extension = os.path.splitext(filename)
+        return '%s.%s%s' % (base_filename, self.profile, extension)
 
     def __init__(self, config_filename,
                  hubstaff_app_token=None,
                  hubstaff_auth_token=None,
                  hubstaff_username=None,
                  hubstaff_password=None,
+                 hubstaff_concurrency=None,
+                 hubstaff_rate_limit=None,
+                 hubstaff_retries=None,
+                 hubstaff_directory_ttl=None,
                  report_filename=None,
                  report_date=None,
+                 report_date_end=None,
                  report_days_ago=None,
+                 report_cache_dirname=None,
+                 report_incremental=None,
+                 report_stats_filename=None,
+                 report_formats=None,
+                 report_compress=None,
+                 report_sort=None,
+                 daemon_interval=None,
+                 daemon_at=None,
+                 email_host=None,
+                 email_port=None,
+                 email_username=None,
+                 email_password=None,
+                 email_starttls=None,
+                 email_from=None,
+                 email_to=None,
+                 email_attach_gzip=None,
+                 profile=None,
                  **kwargs):
         self._config = configparser.ConfigParser()
         self.filename = normalize_path(
             config_filename, default=DEFAULT_CONFIG_FILENAME)
+        self.profile = profile
         self.hubstaff_app_token = hubstaff_app_token
         self.hubstaff_auth_token = hubstaff_auth_token
         self.hubstaff_username = hubstaff_username
         self.hubstaff_password = hubstaff_password
+        self.hubstaff_concurrency = hubstaff_concurrency
+        self.hubstaff_rate_limit = hubstaff_rate_limit
+        self.hubstaff_retries = hubstaff_retries
+        self.hubstaff_directory_ttl = hubstaff_directory_ttl
         self.report_filename = report_filename
         self.report_date = report_date
+        self.report_date_end = report_date_end
         self.report_days_ago = report_days_ago
+        self.report_cache_dirname = report_cache_dirname
+        self.report_incremental = report_incremental
+        self.report_stats_filename = report_stats_filename
+        self.report_formats = report_formats
+        self.report_compress = report_compress
+        self.report_sort = report_sort
+        self.daemon_interval = daemon_interval
+        self.daemon_at = daemon_at
+        self.email_host = email_host
+        self.email_port = email_port
+        self.email_username = email_username
+        self.email_password = email_password
+        self.email_starttls = email_starttls
+        self.email_from = email_from
+        self.email_to = email_to
+        self.email_attach_gzip = email_attach_gzip
+        self._loaded_data = {}
 
-    def load(self):
+    def _read_file(self, config):
         try:
             with open(self.filename, 'r') as f:
                 try:
-                    self._config.read_file(f)
+                    config.read_file(f)
                 except configparser.MissingSectionHeaderError:
                     pass  # bad file format
         except IOError:
             pass  # file not found or can't be open
+
+    def _dump_sections(self):
+        sections_data = {}
         for section_name, schema_class in self.sections.items():
-            try:
-                section_data = self._config[section_name]
-            except (KeyError, configparser.NoSectionError):
-                section_data = {}
+            schema = schema_class(strict=True)
+            dumped_data, _ = schema.dump(self)
+            sections_data[section_name] = collections.OrderedDict(
+                (key, value or '') for key, value in dumped_data.items())
+        return sections_data
+
+    def load(self):
+        # the daily time given without an interval replaces the saved one
+        is_daily = self.daemon_at is not None and self.daemon_interval is None
+        self._read_file(self._config)
+        for section_name, schema_class in self.sections.items():
+            section_data = self._get_section_data(section_name)
             schema = schema_class(strict=True)
             schema_data = {}
             for field_name, field in schema.fields.items():
-                value = (
-                    getattr(self, field_name) or
-                    os.environ.get(field_name.upper()) or
-                    section_data.get(field.load_from, '')
-                )
+                value = getattr(self, field_name)
+                if value is None or value == '':
+                    # False or 0 given to the constructor win over the file
+                    value = (
+                        os.environ.get(field_name.upper()) or
+                        ('' if field.load_only else
+                         section_data.get(field.load_from, ''))
+                    )
                 if value != '':
                     schema_data[field.load_from] = value
             loaded_data, _ = schema.load(schema_data)
             for attr_name, value in loaded_data.items():
                 setattr(self, attr_name, value)
+        if self.profile:
+            # the profiles must not overwrite files of each other
+            report_section = self._get_section_name('report')
+            if not self._config.has_option(report_section, 'html_file'):
+                self.report_filename = self._add_profile_suffix(
+                    self.report_filename)
+            if (self.report_stats_filename and
+                    not self._config.has_option(report_section, 'stats_file')):
+                self.report_stats_filename = self._add_profile_suffix(
+                    self.report_stats_filename)
+        if is_daily:
+            self.daemon_interval = None
+        self._loaded_data = self._dump_sections()
 
     def save(self):
-        for section_name, schema_class in self.sections.items():
-            if section_name not in self._config:
-                self._config[section_name] = {}
-            schema = schema_class(strict=True)
-            dumped_data, _ = schema.dump(self)
-            for key, value in dumped_data.items():
-                self._config[section_name][key] = value or ''
-        with open(self.filename, 'w+') as f:
-            self._config.write(f)
+        """Merges the values into the current file under the lock,
+        so the processes saving their profiles keep the values of each other.
+        The profile sections get only the values changed since the load,
+        the rest still fall back to the base sections.
+        Returns True if the file is changed.
+        """
+        with file_lock(self.filename):
+            config = configparser.ConfigParser()
+            self._read_file(config)
+            for base_name, dumped_data in self._dump_sections().items():
+                loaded_data = self._loaded_data.get(base_name, {})
+                section_name = self._get_section_name(base_name)
+                for key, value in dumped_data.items():
+                    if self.profile and value == loaded_data.get(key, ''):
+                        continue  # the profile doesn't own the value
+                    if section_name not in config:
+                        config[section_name] = {}
+                    config[section_name][key] = value
+                if section_name in config:
+                    # the per-run values saved by the older versions
+                    schema = self.sections[base_name]()
+                    for field in schema.fields.values():
+                        if field.load_only:
+                            config.remove_option(
+                                section_name, field.load_from)
+            self._config = config
+            buffer = io.StringIO()
+            config.write(buffer)
+            # the file keeps the credentials
+            return atomic_write(
+                self.filename, [buffer.getvalue()], mode=0o600)
 
     @property
     def report_date_from(self):
@@ -158,129 +816,1573 @@ class Config:
 
     @property
     def report_date_to(self):
+        if self.report_date_end:
+            # the end date is included into the report
+            return self.report_date_end + datetime.timedelta(days=1)
         date_to = self.report_date_from + datetime.timedelta(days=1)
         return date_to
 
+    @property
+    def report_filenames(self):
+        """Returns the file of each report format, the html one is
+        the report_filename, others have the same name with own extension.
+        """
+        base_filename = os.path.splitext(self.report_filename)[0]
+        filenames = {}
+        for report_format in self.report_formats.split(','):
+            report_format = report_format.strip()
+            if report_format == 'html':
+                filenames[report_format] = self.report_filename
+            else:
+                filenames[report_format] = (
+                    base_filename + REPORT_EXPORTERS[report_format].extension)
+        return filenames
+
+    @property
+    def report_compress_encodings(self):
+        if not self.report_compress:
+            return []
+        return [encoding.strip()
+                for encoding in self.report_compress.split(',')]
+
+    @property
+    def email_recipients(self):
+        if not self.email_host or not self.email_to:
+            return []
+        return [recipient.strip() for recipient in self.email_to.split(',')]
+
+    def get_next_build_time(self, now):
+        """Returns when the daemon should rebuild the report:
+        every interval minutes if it's set, otherwise daily at the time.
+        """
+        if self.daemon_interval:
+            return now + datetime.timedelta(minutes=self.daemon_interval)
+        hour, minute = map(int, self.daemon_at.split(':'))
+        next_time = now.replace(
+            hour=hour, minute=minute, second=0, microsecond=0)
+        if next_time <= now:
+            next_time += datetime.timedelta(days=1)
+        return next_time
+
+    @property
+    def cache_namespace(self):
+        key = '%s:%s' % (self.hubstaff_app_token, self.hubstaff_username)
+        if self.profile:
+            # the profiles may share the account but not the cache
+            key = '%s:%s' % (self.profile, key)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+class HubstaffDirectory:
+    """Compact id->name indexes of the hubstaff users and projects."""
+
+    def __init__(self, users=None, projects=None):
+        self.users = users or {}
+        self.projects = projects or {}
+
+    @classmethod
+    def from_users_list(cls, users_list):
+        users = {}
+        projects = {}
+        for user_item in users_list:
+            users[user_item['id']] = user_item['name']
+            for project_item in user_item['projects']:
+                projects.setdefault(project_item['id'], project_item['name'])
+        return cls(users, projects)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(dict(map(tuple, data['users'])),
+                   dict(map(tuple, data['projects'])))
+
+    def to_dict(self):
+        # pairs keep int ids, sorting keeps the file stable
+        return {
+            'users': sorted(self.users.items()),
+            'projects': sorted(self.projects.items()),
+        }
+
+    def is_complete(self, spent_time):
+        """Checks if all the ids of the spent time matrix are known."""
+        return (all(i in self.users for i in spent_time.users_ids) and
+                all(i in self.projects for i in spent_time.projects_ids))
+
+    def resolve(self, spent_time):
+        """Returns users and projects dicts only for the ids
+        which have any activity in the spent time matrix.
+        Ids missing in the directory are named by themselves.
+        """
+        users_dict = {
+            user_id: {'id': user_id,
+                      'name': self.users.get(user_id, user_id)}
+            for user_id in spent_time.users_ids}
+        projects_dict = {
+            project_id: {'id': project_id,
+                         'name': self.projects.get(project_id, project_id)}
+            for project_id in spent_time.projects_ids}
+        return users_dict, projects_dict
+
+
+class ActivityCache:
+    """Local cache of the hubstaff directory and of the incremental state
+    of the open day under the directory of the account namespace.
+    The closed days are kept by the warehouse, the raw activities
+    cached by the older versions are only read to be moved there.
+    """
+
+    def __init__(self, dirname, namespace):
+        self.dirname = os.path.join(dirname, namespace)
+
+    def _get_filename(self, day, suffix):
+        return os.path.join(self.dirname, '%s.%s' % (day.isoformat(), suffix))
+
+    def _read_lines(self, filename):
+        try:
+            with open(filename, 'r') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except IOError:
+            return None  # day isn't cached yet
+
+    @contextlib.contextmanager
+    def _open_lines(self, filename):
+        """Returns the function which appends items to the file,
+        the file appears only if the block is finished without errors.
+        """
+        os.makedirs(self.dirname, exist_ok=True)
+        # write to temp file first, so a crash can't leave a partial day
+        fd, tmp_filename = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                def write(item):
+                    f.write(json.dumps(item))
+                    f.write('\n')
+                yield write
+            os.replace(tmp_filename, filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    @classmethod
+    def _iter_lines(cls, filename):
+        with open(filename, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _write_lines(self, filename, items):
+        with self._open_lines(filename) as write:
+            for item in items:
+                write(item)
+
+    def get_directory(self, ttl=None):
+        """Returns the cached directory
+        or None if it's missing or older than ttl seconds.
+        """
+        filename = os.path.join(self.dirname, 'directory.json')
+        try:
+            age = time.time() - os.stat(filename).st_mtime
+            if ttl is not None and age >= ttl:
+                return None  # expired
+            with open(filename, 'r') as f:
+                return HubstaffDirectory.from_dict(json.load(f))
+        except IOError:
+            return None  # isn't cached yet
+
+    def set_directory(self, directory):
+        os.makedirs(self.dirname, exist_ok=True)
+        filename = os.path.join(self.dirname, 'directory.json')
+        if not atomic_write(filename, [json.dumps(directory.to_dict())]):
+            os.utime(filename)  # same content, restart its ttl
+
+    def iter_activities(self, day):
+        """Returns the iterator of the raw activities of the day
+        cached by the older versions or None if there're no such.
+        """
+        filename = self._get_filename(day, 'activities.jsonl')
+        if not os.path.exists(filename):
+            return None
+        return self._iter_lines(filename)
+
+    def get_incremental_state(self, day):
+        """Returns the high-water mark of the open day
+        and the cells of the activities started before it.
+        """
+        lines = self._read_lines(self._get_filename(day, 'incremental.jsonl'))
+        if not lines:
+            return None, []
+        return lines[0]['starts_at'], lines[1:]
+
+    def set_incremental_state(self, day, starts_at, cells):
+        self._write_lines(
+            self._get_filename(day, 'incremental.jsonl'),
+            itertools.chain([{'starts_at': starts_at}], cells))
+
+    def remove_day(self, day):
+        """Removes the files of the day stored in the warehouse."""
+        for suffix in ('activities.jsonl', 'incremental.jsonl'):
+            filename = self._get_filename(day, suffix)
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def prune_incremental_states(self, day):
+        """Removes the incremental states of the days before the day,
+        they aren't open anymore.
+        """
+        try:
+            filenames = os.listdir(self.dirname)
+        except OSError:
+            return  # nothing is cached yet
+        for filename in filenames:
+            day_name, _, suffix = filename.partition('.')
+            if suffix == 'incremental.jsonl' and day_name < day.isoformat():
+                os.remove(os.path.join(self.dirname, filename))
+
+
+WAREHOUSE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS days (
+    day TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS spent_time (
+    day TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    project_id INTEGER NOT NULL,
+    tracked INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id, project_id)
+) WITHOUT ROWID;
+'''
+
+
+class DailyWarehouse:
+    """SQLite store of the aggregated spent time of the closed days.
+    Reports of any range are summed up from the stored days by sql.
+    """
+
+    def __init__(self, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self._db = _lazy_import('sqlite3').connect(filename)
+        self._db.executescript(WAREHOUSE_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def get_days(self, date_from, date_to):
+        """Returns the set of the stored days of the range."""
+        rows = self._db.execute(
+            'SELECT day FROM days WHERE day >= ? AND day < ?',
+            (date_from.isoformat(), date_to.isoformat()))
+        return {datetime.datetime.strptime(day, '%Y-%m-%d').date()
+                for day, in rows}
+
+    def set_day(self, day, spent_time):
+        """Replaces the stored matrix of the day."""
+        day = day.isoformat()
+        with self._db:
+            self._db.execute('DELETE FROM spent_time WHERE day = ?', (day,))
+            self._db.executemany(
+                'INSERT INTO spent_time VALUES (?, ?, ?, ?)',
+                ((day, user_id, project_id, seconds)
+                 for (user_id, project_id), seconds in spent_time.items()))
+            self._db.execute('INSERT OR REPLACE INTO days VALUES (?)', (day,))
+
+    def rollup(self, spent_time, date_from, date_to):
+        """Adds the stored days of the range to the matrix."""
+        rows = self._db.execute(
+            'SELECT user_id, project_id, SUM(tracked) FROM spent_time '
+            'WHERE day >= ? AND day < ? GROUP BY user_id, project_id',
+            (date_from.isoformat(), date_to.isoformat()))
+        for user_id, project_id, seconds in rows:
+            spent_time.add(user_id, project_id, seconds)
+
+
+# users_ids: ordered columns, rows: (project_id, cells, total) tuples,
+# totals: totals of the columns, total: the grand total
+ReportTable = collections.namedtuple(
+    'ReportTable', 'users_ids rows totals total')
+
+
+class SpentTimeMatrix:
+    """Tracked seconds of users (columns) on projects (rows).
+    User and project ids are mapped to dense indexes
+    and every row is kept in a compact array.
+    Totals of the columns and rows are summed up on the way.
+    """
+    typecode = 'l'
+
+    def __init__(self):
+        self._users_index = {}
+        self._projects_index = {}
+        self._rows = []
+        self._users_totals = array(self.typecode)
+        self._projects_totals = array(self.typecode)
+        self.total = 0
+
+    @property
+    def users_ids(self):
+        return list(self._users_index)
+
+    @property
+    def projects_ids(self):
+        return list(self._projects_index)
+
+    def add_user(self, user_id):
+        index = self._users_index.get(user_id)
+        if index is None:
+            index = self._users_index[user_id] = len(self._users_index)
+            self._users_totals.append(0)
+        return index
+
+    def add_project(self, project_id):
+        index = self._projects_index.get(project_id)
+        if index is None:
+            index = self._projects_index[project_id] = len(self._rows)
+            self._rows.append(array(self.typecode))
+            self._projects_totals.append(0)
+        return index
+
+    def _get_full_row(self, index):
+        row = self._rows[index]
+        width = len(self._users_index)
+        if len(row) < width:
+            row.extend(array(self.typecode, [0]) * (width - len(row)))
+        return row
+
+    def add(self, user_id, project_id, seconds):
+        column = self.add_user(user_id)
+        index = self.add_project(project_id)
+        self._add_cell(index, column, seconds)
+
+    def _add_cell(self, index, column, seconds):
+        self._get_full_row(index)[column] += seconds
+        self._users_totals[column] += seconds
+        self._projects_totals[index] += seconds
+        self.total += seconds
+
+    def get_user_total(self, user_id):
+        return self._users_totals[self._users_index[user_id]]
+
+    def get_project_total(self, project_id):
+        return self._projects_totals[self._projects_index[project_id]]
+
+    def get(self, user_id, project_id, default=0):
+        column = self._users_index.get(user_id)
+        index = self._projects_index.get(project_id)
+        if column is None or index is None:
+            return default
+        row = self._rows[index]
+        return row[column] if column < len(row) else 0
+
+    def iter_rows(self):
+        """Yields (project_id, row) pairs,
+        row values are ordered as users_ids.
+        """
+        for project_id, index in self._projects_index.items():
+            yield project_id, self._get_full_row(index)
+
+    def iter_column(self, user_id):
+        """Yields (project_id, seconds) pairs of the given user."""
+        column = self._users_index[user_id]
+        for project_id, index in self._projects_index.items():
+            row = self._rows[index]
+            yield project_id, row[column] if column < len(row) else 0
+
+    def items(self):
+        """Yields ((user_id, project_id), seconds) of non empty cells."""
+        users_ids = self.users_ids
+        for project_id, index in self._projects_index.items():
+            for column, seconds in enumerate(self._rows[index]):
+                if seconds:
+                    yield (users_ids[column], project_id), seconds
+
+    def add_activities(self, activities):
+        numpy = get_numpy()
+        if numpy is None:
+            self._add_activities_list(activities)
+            return
+        iterator = iter(activities)
+        while True:
+            batch = list(itertools.islice(iterator, NUMPY_MAX_BATCH_SIZE))
+            if len(batch) < NUMPY_MIN_BATCH_SIZE:
+                self._add_activities_list(batch)
+                return
+            self._add_activities_batch(numpy, batch)
+
+    def _add_activities_list(self, activities):
+        for activity_item in activities:
+            self.add(
+                activity_item['user_id'],
+                activity_item['project_id'],
+                activity_item['tracked'])
+
+    def _encode(self, numpy, ids, add_id):
+        """Returns the dense indexes of the ids,
+        new ids are added in order of their first use.
+        """
+        unique_ids, first_use, codes = numpy.unique(
+            numpy.asarray(ids), return_index=True, return_inverse=True)
+        indexes = numpy.empty(len(unique_ids), dtype=numpy.int64)
+        for code in numpy.argsort(first_use, kind='stable').tolist():
+            indexes[code] = add_id(unique_ids[code].item())
+        return indexes[codes]
+
+    def _add_activities_batch(self, numpy, batch):
+        """Sums the tracked seconds of the whole batch by bincount
+        and adds them to the rows through numpy views of the arrays.
+        """
+        get_user_id = operator.itemgetter('user_id')
+        get_project_id = operator.itemgetter('project_id')
+        get_tracked = operator.itemgetter('tracked')
+        columns = self._encode(
+            numpy, list(map(get_user_id, batch)), self.add_user)
+        indexes = self._encode(
+            numpy, list(map(get_project_id, batch)), self.add_project)
+        width = len(self._users_index)
+        cells, codes = numpy.unique(
+            indexes * width + columns, return_inverse=True)
+        seconds = numpy.rint(numpy.bincount(
+            codes, weights=list(map(get_tracked, batch))
+        )).astype(self.typecode)
+        cells_indexes, cells_columns = numpy.divmod(cells, width)
+        # the cells are sorted by rows, each row is updated at once
+        bounds = (numpy.flatnonzero(numpy.diff(cells_indexes)) + 1).tolist()
+        for start, end in zip([0] + bounds, bounds + [len(cells)]):
+            row = numpy.frombuffer(
+                self._get_full_row(int(cells_indexes[start])),
+                dtype=self.typecode)
+            row[cells_columns[start:end]] += seconds[start:end]
+        numpy.add.at(
+            numpy.frombuffer(self._users_totals, dtype=self.typecode),
+            cells_columns, seconds)
+        numpy.add.at(
+            numpy.frombuffer(self._projects_totals, dtype=self.typecode),
+            cells_indexes, seconds)
+        self.total += int(seconds.sum())
+
+    def update(self, other):
+        for (user_id, project_id), seconds in other.items():
+            self.add(user_id, project_id, seconds)
+
+    @classmethod
+    def _sort_ids(cls, index, totals, names, sort_by):
+        def get_name(item_id):
+            return str(names[item_id]['name']).lower(), str(item_id)
+
+        if sort_by == 'total':
+            return sorted(index, key=lambda item_id: (
+                -totals[index[item_id]], get_name(item_id)))
+        return sorted(index, key=get_name)
+
+    def _reorder(self, users_ids, projects_ids):
+        """Moves the columns and rows into the given order in place,
+        only one row is copied at a time.
+        """
+        columns = [self._users_index[user_id] for user_id in users_ids]
+        if columns != list(range(len(columns))):
+            for index in range(len(self._rows)):
+                row = self._get_full_row(index)
+                self._rows[index] = array(
+                    self.typecode, map(row.__getitem__, columns))
+            self._users_totals = array(
+                self.typecode, map(self._users_totals.__getitem__, columns))
+            self._users_index = {
+                user_id: column for column, user_id in enumerate(users_ids)}
+        indexes = [
+            self._projects_index[project_id] for project_id in projects_ids]
+        self._rows = [self._rows[index] for index in indexes]
+        self._projects_totals = array(
+            self.typecode, map(self._projects_totals.__getitem__, indexes))
+        self._projects_index = {
+            project_id: index for index, project_id in enumerate(projects_ids)}
+
+    def get_table(self, users, projects, sort_by=DEFAULT_REPORT_SORT):
+        """Returns the report table with users and projects
+        ordered by name or by total time (the biggest first).
+        The matrix is reordered the same way to share its rows
+        with the table instead of copying them.
+        """
+        users_ids = self._sort_ids(
+            self._users_index, self._users_totals, users, sort_by)
+        projects_ids = self._sort_ids(
+            self._projects_index, self._projects_totals, projects, sort_by)
+        self._reorder(users_ids, projects_ids)
+        rows = [
+            (project_id, self._get_full_row(index),
+             self._projects_totals[index])
+            for project_id, index in self._projects_index.items()]
+        return ReportTable(
+            users_ids, rows, self._users_totals.tolist(), self.total)
+
+
+class Stats:
+    """Wall time of the pipeline stages and counters of the api calls.
+    Time of the stages running concurrently (e.g. the api calls)
+    is summed up.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def timed_iter(self, name, iterable):
+        """Yields the items, the time spent producing them
+        is added to the stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(name, time.perf_counter() - started)
+            yield item
+
+    def to_dict(self):
+        return {
+            'timings': dict(self.timings),
+            'counters': dict(self.counters),
+        }
+
+    def to_prometheus(self):
+        lines = ['# TYPE rtbot34_stage_seconds gauge']
+        for name, seconds in sorted(self.timings.items()):
+            lines.append(
+                'rtbot34_stage_seconds{stage="%s"} %.6f' % (name, seconds))
+        for name, value in sorted(self.counters.items()):
+            lines.append('# TYPE rtbot34_%s gauge' % name)
+            lines.append('rtbot34_%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename):
+        """Writes the json summary or the prometheus textfile
+        if the file has .prom extension.
+        """
+        if filename.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        # the textfile collector must never read a partial file
+        atomic_write(filename, (content,))
+
+
+class StageProfiler:
+    """Cpu (cProfile) and memory (tracemalloc) profiles of the stages.
+    A nested stage pauses the outer one,
+    so each profile doesn't include its nested stages.
+    """
+    top_allocations = 10
+
+    def __init__(self):
+        self.profiles = {}
+        self.summary = {}
+        self._stack = []
+
+    def _resume(self, name):
+        _lazy_import('tracemalloc').start()
+        self.profiles[name].enable()
+
+    def _pause(self, name, is_finished=False):
+        tracemalloc = _lazy_import('tracemalloc')
+        self.profiles[name].disable()
+        _, peak = tracemalloc.get_traced_memory()
+        summary = self.summary[name]
+        summary['peak_bytes'] = max(summary['peak_bytes'], peak)
+        if is_finished:
+            # the biggest allocations still alive at the stage end
+            statistics = tracemalloc.take_snapshot().statistics('lineno')
+            summary['top_allocations'] = [
+                str(stat) for stat in statistics[:self.top_allocations]]
+        tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self._stack:
+            self._pause(self._stack[-1])
+        self.profiles[name] = _lazy_import('cProfile').Profile()
+        self.summary[name] = {'peak_bytes': 0, 'top_allocations': []}
+        self._stack.append(name)
+        self._resume(name)
+        try:
+            yield
+        finally:
+            self._pause(name, is_finished=True)
+            self._stack.pop()
+            if self._stack:
+                self._resume(self._stack[-1])
+
+    def save(self, prefix):
+        """Writes <prefix>.<stage>.pstats files
+        and <prefix>.profile.json summary of the memory peaks.
+        """
+        for name, profile in self.profiles.items():
+            profile.dump_stats('%s.%s.pstats' % (prefix, name))
+        atomic_write('%s.profile.json' % prefix, (
+            json.dumps(self.summary, indent=2, sort_keys=True),))
+
+
+class RequestScheduler:
+    """Sends the api requests within the token bucket budget
+    (rate requests per second with bursts up to burst requests)
+    and retries the failed ones honoring Retry-After header
+    or with jittered exponential backoff.
+    """
+    backoff_base = 0.5
+    backoff_cap = 60.0
+
+    def __init__(self, rate=None, burst=1, retries=0, stats=None,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.retries = retries or 0
+        self.stats = stats or Stats()
+        self._sleep = sleep
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        """Takes one token, waits until it's available."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # the token is taken now, the debt is waited out
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            self.stats.add_time('throttled', delay)
+            self._sleep(delay)
+
+    @classmethod
+    def _get_status_code(cls, error):
+        status_code = getattr(error, 'status_code', None)
+        if status_code is None:
+            response = getattr(error, 'response', None)
+            status_code = getattr(response, 'status_code', None)
+        return status_code
+
+    @classmethod
+    def is_retryable(cls, error):
+        if isinstance(error, _lazy_import('HubstaffAuthError')):
+            return False
+        status_code = cls._get_status_code(error)
+        if status_code is not None:
+            return status_code == 429 or status_code >= 500
+        # connection errors and timeouts
+        return isinstance(error, OSError)
+
+    @classmethod
+    def get_retry_after(cls, error):
+        """Returns seconds from Retry-After header of the error response."""
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        value = headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = _lazy_import('parsedate_to_datetime')(value)
+        except (TypeError, ValueError):
+            return None  # bad header
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max((retry_at - now).total_seconds(), 0.0)
+
+    def get_backoff(self, attempt):
+        """Full jitter exponential backoff."""
+        return random.uniform(
+            0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.retries or not self.is_retryable(e):
+                    raise
+                delay = self.get_retry_after(e)
+                if delay is None:
+                    delay = self.get_backoff(attempt)
+            attempt += 1
+            self.stats.count('retries')
+            self._sleep(delay)
+
+
+class AsyncHubstaffClient:
+    """Asyncio facade of the hubstaff client.
+    The blocking calls run in a bounded pool of threads,
+    all of them share the keep-alive connections of the wrapped client.
+    If the api rejects the auth token, the client is replaced
+    by the one returned from reauthenticate and the call is repeated.
+    """
+
+    def __init__(self, client, concurrency, reauthenticate=None, stats=None,
+                 scheduler=None):
+        self._client = client
+        self._executor = _lazy_import('ThreadPoolExecutor')(
+            max_workers=concurrency)
+        self._reauthenticate = reauthenticate
+        self._stats = stats or Stats()
+        self._scheduler = scheduler or RequestScheduler(stats=self._stats)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _request(self, client, method_name, *args, **kwargs):
+        method = getattr(client, method_name)
+
+        def request():
+            self._stats.count('requests')
+            return method(*args, **kwargs)
+
+        result = self._scheduler.call(request)
+        self._stats.count('records', len(result))
+        return result
+
+    def _call_sync(self, stage_name, method_name, *args, **kwargs):
+        with self._stats.stage(stage_name):
+            client = self._client
+            try:
+                return self._request(client, method_name, *args, **kwargs)
+            except _lazy_import('HubstaffAuthError'):
+                if self._reauthenticate is None:
+                    raise
+            with self._lock:
+                # only the first of the concurrently rejected calls renews it
+                if self._client is client:
+                    with self._stats.stage('reauthenticate'):
+                        self._client = self._reauthenticate()
+            self._stats.count('retries')
+            return self._request(self._client, method_name, *args, **kwargs)
+
+    async def _call(self, stage_name, method_name, *args, **kwargs):
+        loop = _lazy_import('asyncio').get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(
+                self._call_sync, stage_name, method_name, *args, **kwargs))
+
+    async def get_users_list(self, **kwargs):
+        return await self._call('fetch_users', 'get_users_list', **kwargs)
+
+    async def get_activities_list(self, date_from, date_to, **kwargs):
+        return await self._call(
+            'fetch_activities', 'get_activities_list',
+            date_from, date_to, **kwargs)
+
+
+class RecordingClient:
+    """Hubstaff client wrapper which saves every api response
+    into the directory to be replayed by ReplayClient.
+    """
+    def __init__(self, client, dirname):
+        self._client = client
+        self.dirname = dirname
+
+    @classmethod
+    def get_filename(cls, dirname, method_name, *args, **kwargs):
+        """Responses are keyed by the method and its arguments."""
+        key = json.dumps([method_name, args, kwargs],
+                         sort_keys=True, default=str)
+        key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(dirname, '%s.%s.json' % (method_name, key_hash))
+
+    def authenticate(self):
+        # the token isn't recorded, replay doesn't need it
+        return self._client.authenticate()
+
+    def _record(self, method_name, *args, **kwargs):
+        response = getattr(self._client, method_name)(*args, **kwargs)
+        os.makedirs(self.dirname, exist_ok=True)
+        atomic_write(
+            self.get_filename(self.dirname, method_name, *args, **kwargs),
+            [json.dumps(response)])
+        return response
+
+    def get_users_list(self, *args, **kwargs):
+        return self._record('get_users_list', *args, **kwargs)
+
+    def get_activities_list(self, *args, **kwargs):
+        return self._record('get_activities_list', *args, **kwargs)
+
+
+class NotRecordedError(LookupError):
+    """The replayed request has no recorded response."""
+
+
+class ReplayClient:
+    """Serves the responses saved by RecordingClient
+    through the hubstaff client interface, without network.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def authenticate(self):
+        return None
+
+    def _replay(self, method_name, *args, **kwargs):
+        filename = RecordingClient.get_filename(
+            self.dirname, method_name, *args, **kwargs)
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except IOError:
+            raise NotRecordedError('response of %s%r%r is not recorded' % (
+                method_name, args, kwargs))
+
+    def get_users_list(self, *args, **kwargs):
+        return self._replay('get_users_list', *args, **kwargs)
+
+    def get_activities_list(self, *args, **kwargs):
+        return self._replay('get_activities_list', *args, **kwargs)
+
+
+def parse_timestamp(value):
+    """Parses hubstaff timestamp like: "2001-02-03T04:05:06Z"."""
+    return datetime.datetime.strptime(
+        value[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+
+
+def to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def get_report_table(data):
+    """Returns the table of the report data,
+    it's built with the default order if the data hasn't it.
+    """
+    table = data.get('table')
+    if table is None:
+        table = data['spent_time'].get_table(data['users'], data['projects'])
+    return table
+
+
+def export_html(data):
+    return get_template('report.html').generate(
+        **dict(data, table=get_report_table(data)))
+
+
+def export_csv(data):
+    """The same matrix as the html report:
+    users in columns, projects in rows, totals in the last ones.
+    """
+    table = get_report_table(data)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    writer.writerow([''] + [
+        data['users'][user_id]['name'] for user_id in table.users_ids] +
+        ['Total'])
+    yield flush()
+    for project_id, cells, total in table.rows:
+        writer.writerow(
+            [data['projects'][project_id]['name']] + list(cells) + [total])
+        yield flush()
+    writer.writerow(['Total'] + table.totals + [table.total])
+    yield flush()
+
+
+def export_jsonl(data):
+    """One json line per each not empty cell of the matrix."""
+    date_from = data['date_from'].isoformat()
+    date_to = data['date_to'].isoformat()
+    for (user_id, project_id), seconds in data['spent_time'].items():
+        yield json.dumps({
+            'date_from': date_from,
+            'date_to': date_to,
+            'user_id': user_id,
+            'user_name': data['users'][user_id]['name'],
+            'project_id': project_id,
+            'project_name': data['projects'][project_id]['name'],
+            'tracked': seconds,
+        }) + '\n'
+
+
+COLUMNAR_MAGIC = b'RTBOT34C'
+
+
+def export_columnar(data):
+    """Binary columns of the not empty cells: the json header
+    with users and projects, then little-endian arrays of
+    user indexes (int32), project indexes (int32) and seconds (int64).
+    """
+    spent_time = data['spent_time']
+    users_index = {
+        user_id: index for index, user_id in enumerate(spent_time.users_ids)}
+    projects_index = {
+        project_id: index
+        for index, project_id in enumerate(spent_time.projects_ids)}
+    columns = (array('i'), array('i'), array('q'))
+    for (user_id, project_id), seconds in spent_time.items():
+        columns[0].append(users_index[user_id])
+        columns[1].append(projects_index[project_id])
+        columns[2].append(seconds)
+    header = json.dumps({
+        'date_from': data['date_from'].isoformat(),
+        'date_to': data['date_to'].isoformat(),
+        'users': [data['users'][user_id] for user_id in users_index],
+        'projects': [
+            data['projects'][project_id] for project_id in projects_index],
+        'cells': len(columns[2]),
+    }).encode('utf-8')
+    yield COLUMNAR_MAGIC + struct.pack('<I', len(header)) + header
+    for column in columns:
+        if sys.byteorder == 'big':
+            column.byteswap()
+        yield column.tobytes()
+
+
+def load_columnar(f):
+    """Reads the binary file written by export_columnar.
+    Returns the header dict and the three columns.
+    """
+    if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('not a columnar report file')
+    header_size, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(header_size).decode('utf-8'))
+    columns = (array('i'), array('i'), array('q'))
+    for column in columns:
+        column.frombytes(f.read(header['cells'] * column.itemsize))
+        if sys.byteorder == 'big':
+            column.byteswap()
+    return header, columns
+
+
+Exporter = collections.namedtuple('Exporter', 'extension binary export')
+
+REPORT_EXPORTERS = {
+    'html': Exporter('.html', False, export_html),
+    'csv': Exporter('.csv', False, export_csv),
+    'jsonl': Exporter('.jsonl', False, export_jsonl),
+    'columnar': Exporter('.col', True, export_columnar),
+}
+
 
 class Command:
-    def __init__(self, **opts):
+    def __init__(self, record_dirname=None, replay_dirname=None,
+                 profile_stages=False, **opts):
         self._logger = logging.getLogger(__name__)
         self._logger.setLevel(logging.WARNING)
         self._config = Config(**opts)
+        self._record_dirname = normalize_path(record_dirname)
+        self._replay_dirname = normalize_path(replay_dirname)
         self._hubstaff = None
+        self._cache = None
+        self._stats = Stats()
+        self._scheduler = None
+        self._mailer = None
+        self._warehouse = None
+        self._tmp_cache_dirname = None
+        self._profiler = StageProfiler() if profile_stages else None
+
+    def _get_cache_dirname(self):
+        """Record and replay run on their own empty temp cache,
+        so every request goes to the client
+        and the warehouse of the real reports isn't touched.
+        """
+        if not (self._record_dirname or self._replay_dirname):
+            return self._config.report_cache_dirname
+        if self._tmp_cache_dirname is None:
+            self._tmp_cache_dirname = tempfile.mkdtemp(prefix='rtbot34cache')
+        return self._tmp_cache_dirname
+
+    def _remove_tmp_cache(self):
+        if self._tmp_cache_dirname is not None:
+            shutil.rmtree(self._tmp_cache_dirname, ignore_errors=True)
+            self._tmp_cache_dirname = None
+
+    def _get_recording_dirname(self, dirname):
+        """The responses of every account and profile
+        are kept apart in the recording.
+        """
+        return os.path.join(dirname, self._config.cache_namespace)
 
     def _load_config(self):
         self._config.load()
+        self._cache = ActivityCache(
+            dirname=self._get_cache_dirname(),
+            namespace=self._config.cache_namespace)
 
     def _init_client(self):
-        self._hubstaff = HubstaffClient(
+        if self._replay_dirname:
+            self._hubstaff = ReplayClient(
+                self._get_recording_dirname(self._replay_dirname))
+            return
+        self._hubstaff = _lazy_import('HubstaffClient')(
             app_token=self._config.hubstaff_app_token,
             auth_token=self._config.hubstaff_auth_token,
             username=self._config.hubstaff_username,
             password=self._config.hubstaff_password)
-        # set given auth_token to the config
-        self._config.hubstaff_auth_token = self._hubstaff.authenticate()
+        if self._record_dirname:
+            self._hubstaff = RecordingClient(
+                self._hubstaff,
+                self._get_recording_dirname(self._record_dirname))
+        # the stored auth_token is used until the api rejects it
+        if not self._config.hubstaff_auth_token:
+            # set given auth_token to the config
+            self._config.hubstaff_auth_token = self._hubstaff.authenticate()
+
+    def _get_scheduler(self):
+        """The scheduler lives as long as the command,
+        so its budget is shared by all the builds of the daemon.
+        """
+        if self._scheduler is None:
+            self._scheduler = RequestScheduler(
+                # the replayed responses aren't limited
+                rate=(None if self._replay_dirname else
+                      self._config.hubstaff_rate_limit),
+                burst=self._config.hubstaff_concurrency,
+                retries=self._config.hubstaff_retries)
+        self._scheduler.stats = self._stats
+        return self._scheduler
+
+    def _reauthenticate(self):
+        self._config.hubstaff_auth_token = None
+        self._init_client()
+        return self._hubstaff
 
     def _save_config(self):
         self._config.save()
 
-    def _get_report_data(self, date_from, date_to):
-        users_list = self._hubstaff.get_users_list(include_projects=True)
+    @classmethod
+    def _is_closed_day(cls, day):
+        """Data of the days before today can't change anymore
+        and can be cached.
+        """
+        return to_date(day) < datetime.date.today()
 
-        users_dict = {}
-        projects_dict = {}
-        for user_item in users_list:
-            users_dict[user_item['id']] = {
-                'id': user_item['id'],
-                'name': user_item['name'],
-            }
-            for project_item in user_item['projects']:
-                projects_dict[project_item['id']] = {
-                    'id': project_item['id'],
-                    'name': project_item['name'],
-                }
+    @classmethod
+    def _split_date_range(cls, date_from, date_to):
+        """Splits the range into the one day chunks,
+        keeps the type (date or datetime) of the given values.
+        """
+        one_day = datetime.timedelta(days=1)
+        chunk_from = date_from
+        while to_date(chunk_from) < to_date(date_to):
+            yield chunk_from, chunk_from + one_day
+            chunk_from += one_day
 
-        activities_list = self._hubstaff.get_activities_list(date_from, date_to)
+    async def _fetch_directory(self, client):
+        users_list = await client.get_users_list(include_projects=True)
+        directory = HubstaffDirectory.from_users_list(users_list)
+        self._cache.set_directory(directory)
+        return directory
 
-        spent_time_dict = defaultdict(lambda: 0)
-        for activity_item in activities_list:
-            spent_time_dict[
-                (activity_item['user_id'],
-                 activity_item['project_id'])
-            ] += activity_item['tracked']
+    @classmethod
+    async def _iter_activities_pages(cls, client, date_from, date_to):
+        offset = 0
+        while True:
+            activities_list = await client.get_activities_list(
+                date_from, date_to, offset=offset)
+            yield activities_list
+            if len(activities_list) < ACTIVITIES_PAGE_SIZE:
+                break
+            offset += len(activities_list)
+
+    @classmethod
+    async def _join_pages(cls, pages):
+        """Joins the pages into the batches big enough
+        to be aggregated by numpy, if it's installed.
+        """
+        if get_numpy() is None:
+            async for activities_list in pages:
+                yield activities_list
+            return
+        batch = []
+        async for activities_list in pages:
+            batch.extend(activities_list)
+            if len(batch) >= NUMPY_MAX_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _aggregate(self, spent_time, activities):
+        with self._stats.stage('aggregate'):
+            spent_time.add_activities(activities)
+
+    async def _fold_activities(self, client, spent_time, date_from, date_to,
+                               is_alone=False):
+        """Folds the activities of the range into the matrix
+        page by page, so the whole range is never kept in memory.
+        If the matrix is_alone for the day, the day is stored from it.
+        """
+        day = to_date(date_from)
+        if not self._is_closed_day(day) and self._config.report_incremental:
+            await self._fold_new_activities(
+                client, spent_time, date_from, date_to)
+            return
+        pages = self._join_pages(
+            self._iter_activities_pages(client, date_from, date_to))
+        if not self._is_closed_day(day):
+            async for activities_list in pages:
+                self._aggregate(spent_time, activities_list)
+            return
+        # the closed day is aggregated alone to be stored
+        day_time = spent_time if is_alone else SpentTimeMatrix()
+        activities = self._cache.iter_activities(day)
+        if activities is not None:
+            self._aggregate(day_time, activities)
+        else:
+            async for activities_list in pages:
+                self._aggregate(day_time, activities_list)
+        with self._stats.stage('store'):
+            self._get_warehouse().set_day(day, day_time)
+        self._cache.remove_day(day)
+        if not is_alone:
+            spent_time.update(day_time)
+
+    async def _fold_new_activities(self, client, spent_time,
+                                   date_from, date_to):
+        """Incremental mode of the open day: only the activities started
+        since the high-water mark of the previous build are requested.
+        The activities of the latest time slot are not stored,
+        they are requested again because the slot can still grow.
+        """
+        day = to_date(date_from)
+        self._cache.prune_incremental_states(day)
+        starts_at, cells = self._cache.get_incremental_state(day)
+        stored_time = SpentTimeMatrix()
+        for user_id, project_id, seconds in cells:
+            stored_time.add(user_id, project_id, seconds)
+        if starts_at:
+            date_from = parse_timestamp(starts_at)
+
+        latest_starts_at, latest_activities = starts_at, []
+        pages = self._iter_activities_pages(client, date_from, date_to)
+        async for activities_list in pages:
+            for activity_item in activities_list:
+                item_starts_at = activity_item['starts_at']
+                if starts_at and item_starts_at < starts_at:
+                    continue  # it's already stored
+                if latest_starts_at is None or \
+                        item_starts_at > latest_starts_at:
+                    self._aggregate(stored_time, latest_activities)
+                    latest_starts_at = item_starts_at
+                    latest_activities = [activity_item]
+                elif item_starts_at == latest_starts_at:
+                    latest_activities.append(activity_item)
+                else:
+                    stored_time.add_activities((activity_item,))
+
+        if latest_starts_at:
+            self._cache.set_incremental_state(
+                day, latest_starts_at,
+                ([user_id, project_id, seconds]
+                 for (user_id, project_id), seconds in stored_time.items()))
+        spent_time.update(stored_time)
+        self._aggregate(spent_time, latest_activities)
+
+    async def _gather_report_data(self, date_from, date_to):
+        spent_time = SpentTimeMatrix()
+        # the stored days are summed up without any api calls
+        warehouse = self._get_warehouse()
+        stored_days = warehouse.get_days(to_date(date_from), to_date(date_to))
+        if stored_days:
+            with self._stats.stage('rollup'):
+                warehouse.rollup(
+                    spent_time, to_date(date_from), to_date(date_to))
+        chunks = [
+            chunk for chunk in self._split_date_range(date_from, date_to)
+            if to_date(chunk[0]) not in stored_days]
+        with AsyncHubstaffClient(
+                client=self._hubstaff,
+                concurrency=self._config.hubstaff_concurrency,
+                reauthenticate=self._reauthenticate,
+                stats=self._stats,
+                scheduler=self._get_scheduler()) as client:
+            directory = self._cache.get_directory(
+                ttl=self._config.hubstaff_directory_ttl or 0)
+            is_alone = len(chunks) == 1 and not stored_days
+            folds = [self._fold_activities(client, spent_time, *chunk,
+                                           is_alone=is_alone)
+                     for chunk in chunks]
+            if directory is None:
+                directory, *_ = await _lazy_import('asyncio').gather(
+                    self._fetch_directory(client), *folds)
+            else:
+                await _lazy_import('asyncio').gather(*folds)
+                # the cached directory is revalidated
+                # only if the activities have unknown ids
+                if not directory.is_complete(spent_time):
+                    directory = await self._fetch_directory(client)
+        return directory, spent_time
+
+    def _get_report_data(self, date_from, date_to):
+        directory, spent_time = _lazy_import('asyncio').run(
+            self._gather_report_data(date_from, date_to))
+
+        users_dict, projects_dict = directory.resolve(spent_time)
 
         report_data = {
             'date_from': date_from,
             'date_to': date_to,
             'users': users_dict,
             'projects': projects_dict,
-            'spent_time': spent_time_dict,
+            'spent_time': spent_time,
+            'table': spent_time.get_table(
+                users_dict, projects_dict,
+                sort_by=self._config.report_sort or DEFAULT_REPORT_SORT),
         }
         return report_data
 
     @classmethod
-    def _render_report_to_html(cls, data):
-        template = jinja2.Template('''<!DOCTYPE html>
-<html xmlns="http://www.w3.org/1999/xhtml" lang="en">
-  <head>
-    <meta charset="utf-8" />
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <title>rt-bot-34 report {{ date_from }} - {{ date_to }}</title>
-  </head>
-  <body>
-    <h1>{{ date_from }} - {{ date_to }}</h1>
-    <table>
-      <thead>
-        <tr>
-          <th>&nbsp;</th>
-        {% for user_id, user in users.items() %}
-          <th>{{ user.name }}</th>
-        {% endfor %}
-        </tr>
-      </thead>
-      <tbody>
-      {% for project_id, project in projects.items() %}
-        <tr>
-          <td>{{ project.name }}</td>
-        {% for user_id, user in users.items() %}
-          <td>{{ spent_time.get((user_id, project_id), 0) }}</td>
-        {% endfor %}
-        </tr>
-      {% endfor %}
-      </tbody>
-    </table>
-  </body>
-</html>
-''')
-        html = template.render(**data)
+    def _render_report_to_html(cls, data, stream=False):
+        """Returns the whole html string
+        or the generator of its chunks if stream is set.
+        """
+        if stream:
+            return export_html(data)
+        html = get_template('report.html').render(
+            **dict(data, table=get_report_table(data)))
         return html
 
+    @classmethod
+    def _save_report_to_file(cls, chunks, filename, binary=False,
+                             compress=()):
+        """Returns True if the file is changed."""
+        remove_stale_copies(filename, compress)
+        return atomic_write(filename, chunks, binary=binary,
+                            compress=compress)
+
     @classmethod
     def _save_report_html_to_file(cls, html, filename):
-        with open(filename, 'w+') as f:
-            f.write(html)
+        if isinstance(html, str):
+            html = (html,)
+        return cls._save_report_to_file(html, filename)
 
     def _build_report(self):
-        report_data = self._get_report_data(
-            date_from=self._config.report_date_from,
-            date_to=self._config.report_date_to)
-        report_html = self._render_report_to_html(
-            data=report_data)
-        self._save_report_html_to_file(
-            html=report_html,
-            filename=self._config.report_filename)
-        # here you can add sending report html by email ...
+        """Returns True if any report file is changed."""
+        with self._profile('get_report_data'):
+            report_data = self._get_report_data(
+                date_from=self._config.report_date_from,
+                date_to=self._config.report_date_to)
+        is_changed = False
+        # all the formats are exported from the same data
+        for report_format, filename in self._config.report_filenames.items():
+            exporter = REPORT_EXPORTERS[report_format]
+            chunks = self._stats.timed_iter(
+                'render', exporter.export(report_data))
+            render_time = self._stats.timings.get('render', 0.0)
+            with self._stats.stage('write'), \
+                    self._profile('export_%s' % report_format):
+                if self._save_report_to_file(
+                        chunks=chunks, filename=filename,
+                        binary=exporter.binary,
+                        compress=self._config.report_compress_encodings):
+                    is_changed = True
+                else:
+                    self._stats.count('unchanged_files')
+            # the report is rendered while the file is written
+            self._stats.add_time(
+                'write', render_time - self._stats.timings['render'])
+        if is_changed and self._config.email_recipients:
+            self._send_report(report_data)
+        return is_changed
 
-    def handle(self):
+    def _get_mailer(self):
+        if self._mailer is None:
+            self._mailer = ReportMailer(
+                host=self._config.email_host,
+                port=self._config.email_port,
+                username=self._config.email_username,
+                password=self._config.email_password,
+                starttls=self._config.email_starttls,
+                sender=self._config.email_from)
+        return self._mailer
+
+    def _get_warehouse(self):
+        if self._warehouse is None:
+            self._warehouse = DailyWarehouse(
+                os.path.join(self._cache.dirname, 'warehouse.sqlite3'))
+        return self._warehouse
+
+    def _close_warehouse(self):
+        if self._warehouse is not None:
+            self._warehouse.close()
+            self._warehouse = None
+
+    def _close_mailer(self):
+        if self._mailer is not None:
+            self._mailer.close()
+
+    def _send_report(self, report_data):
+        """Queues the html report to the recipients,
+        it's sent while the next report is built.
+        """
+        filename = self._config.report_filenames.get('html')
+        if filename:
+            with open(filename, 'rb') as f:
+                html = f.read()
+        else:
+            html = self._render_report_to_html(report_data).encode('utf-8')
+        subject = 'rt-bot-34 report %s - %s' % (
+            report_data['date_from'], report_data['date_to'])
+        self._get_mailer().send(
+            subject, self._config.email_recipients, html,
+            attach_gzip=self._config.email_attach_gzip)
+
+    def _update_report(self):
         try:
-            self._load_config()
-            self._init_client()
-            self._save_config()
             self._build_report()
-        except HubstaffAuthError:
+        finally:
+            # the auth_token could be renewed while building the report
+            self._save_config()
+
+    def _run_stages(self, *stages):
+        """Runs the stages one by one and logs the expected errors.
+        Returns True if all the stages are done.
+        """
+        try:
+            for stage in stages:
+                name = stage.__name__.lstrip('_')
+                with self._stats.stage(name), self._profile(name):
+                    stage()
+        except _lazy_import('HubstaffAuthError'):
             self._logger.error('hubstaff error: authentication failed')
-        except ma.ValidationError as e:
+        except _lazy_import('ma').ValidationError as e:
             self._logger.error('validation error: %s' % e.messages)
+        except NotRecordedError as e:
+            self._logger.error('replay error: %s' % e)
+        else:
+            return True
+        return False
+
+    def _save_stats(self):
+        if self._config.report_stats_filename:
+            self._stats.save(self._config.report_stats_filename)
+
+    def _profile(self, name):
+        if self._profiler is None:
+            return contextlib.nullcontext()
+        return self._profiler.stage(name)
+
+    def _save_profiles(self):
+        """The profiles are saved next to the report."""
+        if self._profiler is not None and self._config.report_filename:
+            self._profiler.save(
+                os.path.splitext(self._config.report_filename)[0])
+
+    def handle(self):
+        self._stats = Stats()
+        try:
+            return self._run_stages(
+                self._load_config,
+                self._init_client,
+                self._update_report)
+        finally:
+            self._close_mailer()
+            self._close_warehouse()
+            self._remove_tmp_cache()
+            self._save_stats()
+            self._save_profiles()
+
+    def serve(self, sleep=time.sleep):
+        """Daemon mode: the config and the client are loaded once,
+        then the report is rebuilt on schedule until interrupted.
+        """
+        if not self._run_stages(self._load_config, self._init_client):
+            return
+        try:
+            while True:
+                self._stats = Stats()
+                try:
+                    self._run_stages(self._update_report)
+                except Exception:
+                    # the daemon keeps to the schedule, the next build
+                    # may succeed when the network or the api are back
+                    self._logger.exception('report build failed')
+                self._save_stats()
+                self._save_profiles()
+                now = datetime.datetime.now()
+                next_time = self._config.get_next_build_time(now)
+                sleep((next_time - now).total_seconds())
+        finally:
+            self._close_mailer()
+            self._close_warehouse()
+            self._remove_tmp_cache()
+
+
+class ReportMailer:
+    """Sends the report messages from the background thread
+    over one SMTP connection which is reused for all of them.
+    The messages are prepared in that thread too,
+    so the next report is built meanwhile.
+    """
+
+    def __init__(self, host, port=DEFAULT_EMAIL_PORT, username=None,
+                 password=None, starttls=False, sender=None, timeout=30):
+        self._logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.sender = sender or username
+        self.timeout = timeout
+        self.errors = []
+        self._queue = queue.Queue()
+        self._thread = None
+        self._smtp = None
+
+    def send(self, subject, recipients, html, attach_gzip=False):
+        """Queues the message with the html report (bytes)
+        to all the recipients.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='rtbot34-mailer', daemon=True)
+            self._thread.start()
+        self._queue.put((subject, recipients, html, attach_gzip))
+
+    def close(self):
+        """Waits until the queued messages are sent
+        and closes the connection.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def build_message(self, subject, recipients, html, attach_gzip=False):
+        message = _lazy_import('EmailMessage')()
+        message['Subject'] = subject
+        message['From'] = self.sender
+        message['To'] = ', '.join(recipients)
+        if attach_gzip:
+            # big tables are much smaller compressed
+            message.set_content('The report is attached.')
+            message.add_attachment(
+                gzip.compress(html), maintype='application',
+                subtype='gzip', filename='report.html.gz')
+        else:
+            message.set_content(html.decode('utf-8'), subtype='html')
+        return message
+
+    def _connect(self):
+        smtplib = _lazy_import('smtplib')
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def _get_connection(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (_lazy_import('smtplib').SMTPException, OSError):
+                pass  # the server has dropped the idle connection
+        self._smtp = self._connect()
+        return self._smtp
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (_lazy_import('smtplib').SMTPException, OSError):
+                pass  # already closed
+            self._smtp = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                message = self.build_message(*item)
+                self._get_connection().send_message(message)
+            except Exception as e:
+                # the thread must keep sending the next messages
+                self._logger.error('email error: %r' % e)
+                self.errors.append(e)
+        self._disconnect()
+
+
+def handle_profile(opts):
+    """Builds the report of one profile in a worker process."""
+    return Command(**opts).handle()
+
+
+class BatchCommand:
+    """Builds the reports of all the config profiles
+    in parallel across a pool of processes.
+    """
+
+    def __init__(self, processes=None, **opts):
+        self._logger = logging.getLogger(__name__)
+        self._logger.setLevel(logging.WARNING)
+        self._processes = processes
+        self._opts = opts
+        self.errors = {}
+
+    def handle(self):
+        """Returns the dict of profile names and their success flags,
+        the unexpected exceptions are kept in the errors dict.
+        """
+        profiles = Config.list_profiles(self._opts.get('config_filename'))
+        results = {}
+        if not profiles:
+            self._logger.error('config error: no profiles are found')
+            return results
+        with _lazy_import('ProcessPoolExecutor')(
+                max_workers=self._processes) as executor:
+            futures = {
+                profile: executor.submit(
+                    handle_profile, dict(self._opts, profile=profile))
+                for profile in profiles
+            }
+            for profile, future in futures.items():
+                try:
+                    results[profile] = future.result()
+                except Exception as e:
+                    self._logger.error('profile %s error: %r' % (profile, e))
+                    self.errors[profile] = e
+                    results[profile] = False
+        return results
 
 
 if __name__ == '__main__':
@@ -306,22 +2408,136 @@ if __name__ == '__main__':
         '--password', dest='hubstaff_password', action='store_true',
         help='Ask hubstaff password. '
              'You can also setup environment variable: HUBSTAFF_PASSWORD')
+    parser.add_argument(
+        '--concurrency', dest='hubstaff_concurrency', type=int,
+        help='How many requests can be sent to hubstaff at the same time. '
+             'Must be in range of: 1..32. Default: 4')
+    parser.add_argument(
+        '--rate-limit', dest='hubstaff_rate_limit', type=float,
+        help='How many requests per second can be sent to hubstaff. '
+             'Default: 5')
+    parser.add_argument(
+        '--retries', dest='hubstaff_retries', type=int,
+        help='How many times a failed or throttled request is repeated. '
+             'Must be in range of: 0..20. Default: 5')
+    parser.add_argument(
+        '--directory-ttl', dest='hubstaff_directory_ttl', type=int,
+        help='How many seconds the users and projects directory is cached. '
+             'Default: %d' % DEFAULT_DIRECTORY_TTL)
     parser.add_argument(
         '-html', '--html-file', dest='report_filename', type=str,
         help='Path to the html report export file. '
              'Default: %s' % DEFAULT_REPORT_FILENAME)
     parser.add_argument(
-        '-d', '--date', dest='report_date', type=str,
-        help='Report date in format: "YYYY-MM-DD". Default: yesterday')
+        '--formats', dest='report_formats', type=str,
+        help='Comma separated report formats: html, csv, jsonl, columnar. '
+             'Files of other formats are saved next to the html file. '
+             'Default: %s' % DEFAULT_REPORT_FORMATS)
+    parser.add_argument(
+        '--compress', dest='report_compress', type=str,
+        help='Comma separated encodings of the compressed copies '
+             'saved next to the report files: gzip, brotli '
+             '(if brotli package is installed).')
+    parser.add_argument(
+        '--sort', dest='report_sort', choices=REPORT_SORTS,
+        help='Order of the users and projects in the report: '
+             'by name or by total time. Default: %s' % DEFAULT_REPORT_SORT)
+    parser.add_argument(
+        '-d', '--date', '--date-from', dest='report_date', type=str,
+        help='Report date in format: "YYYY-MM-DD". Default: yesterday. '
+             'It is the first day of the range if --date-to is given')
+    parser.add_argument(
+        '--date-to', dest='report_date_end', type=str,
+        help='The last day (included) of the report date range '
+             'in format: "YYYY-MM-DD". Default: the same as --date-from')
     parser.add_argument(
         '--days-ago', dest='report_days_ago', type=int,
         help='Instead of use previous param --date you can setup '
              'how many days ago from current date the report should be. '
              'Must be in range of: 0..7')
+    parser.add_argument(
+        '--cache-dir', dest='report_cache_dirname', type=str,
+        help='Path to the directory of cached hubstaff data of closed days. '
+             'Default: %s' % DEFAULT_CACHE_DIRNAME)
+    parser.add_argument(
+        '--incremental', dest='report_incremental', action='store_true',
+        default=None,
+        help='Fetch only new activities of the current day, '
+             'the older ones are taken from the previous build.')
+    parser.add_argument(
+        '--no-incremental', dest='report_incremental', action='store_false',
+        default=None,
+        help='Fetch the whole current day, even if --incremental is saved '
+             'in the config file.')
+    parser.add_argument(
+        '--stats-file', dest='report_stats_filename', type=str,
+        help='Path to the file of the stages timings and api counters '
+             'written after each build: json or prometheus textfile '
+             'if the file has .prom extension.')
+    parser.add_argument(
+        '--profile', dest='profile', type=str,
+        help='Use [hubstaff:<name>] and [report:<name>] config sections, '
+             'their values fall back to [hubstaff] and [report] ones.')
+    parser.add_argument(
+        '--all-profiles', dest='all_profiles', action='store_true',
+        help='Build the reports of all the config profiles in parallel.')
+    parser.add_argument(
+        '--processes', dest='processes', type=int,
+        help='How many profiles are built at the same time. '
+             'Default: the number of CPUs')
+    parser.add_argument(
+        '--daemon', dest='daemon', action='store_true',
+        help='Keep running and rebuild the report on schedule.')
+    parser.add_argument(
+        '--every', dest='daemon_interval', type=int,
+        help='Daemon mode: rebuild the report every given minutes. '
+             'Must be in range of: 1..1440')
+    parser.add_argument(
+        '--at', dest='daemon_at', type=str,
+        help='Daemon mode: rebuild the report daily at the given time '
+             'in format: "HH:MM", it replaces the saved --every '
+             'unless that is given too. '
+             'Default: %s' % DEFAULT_DAEMON_AT)
+    parser.add_argument(
+        '--email-host', dest='email_host', type=str,
+        help='SMTP server which sends the changed reports by email.')
+    parser.add_argument(
+        '--email-to', dest='email_to', type=str,
+        help='Comma separated email addresses of the report recipients.')
+    parser.add_argument(
+        '--record', dest='record_dirname', type=str,
+        help='Save every hubstaff api response into the given directory, '
+             'the local cache is bypassed.')
+    parser.add_argument(
+        '--replay', dest='replay_dirname', type=str,
+        help='Serve the hubstaff api responses saved by --record '
+             'from the given directory instead of the api, '
+             'they are kept per account and profile.')
+    parser.add_argument(
+        '--profile-stages', dest='profile_stages', action='store_true',
+        help='Save cpu profiles (<report>.<stage>.pstats) and memory peaks '
+             '(<report>.profile.json) of the stages next to the report.')
     args = parser.parse_args()
 
     # input password
     if args.hubstaff_password:
         args.hubstaff_password = getpass.getpass('Password: ')
 
-    Command(**args.__dict__).handle()
+    daemon = args.__dict__.pop('daemon')
+    all_profiles = args.__dict__.pop('all_profiles')
+    processes = args.__dict__.pop('processes')
+    if all_profiles and daemon:
+        parser.error('--all-profiles can not be used with --daemon, '
+                     'run a daemon per --profile instead')
+    if all_profiles:
+        batch_results = BatchCommand(
+            processes=processes, **args.__dict__).handle()
+        sys.exit(0 if batch_results and all(batch_results.values()) else 1)
+    command = Command(**args.__dict__)
+    if daemon:
+        try:
+            command.serve()
+        except KeyboardInterrupt:
+            pass
+    else:
+        command.handle()
@@ -0,0 +1,114 @@
+import unittest
+import os
+import shutil
+import json
+import datetime
+
+from rtbot34 import ActivityCache, HubstaffDirectory
+
+
+class TestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dirname = '/tmp/.rtbot34cache'
+        cls.day = datetime.date(2001, 2, 3)
+
+    def setUp(self):
+        if os.path.exists(self.cache_dirname):
+            shutil.rmtree(self.cache_dirname)
+        self.cache = ActivityCache(dirname=self.cache_dirname,
+                                   namespace='test')
+
+    def test_dirname_contains_namespace(self):
+        self.assertEqual(self.cache.dirname, '/tmp/.rtbot34cache/test')
+
+    def test_get_missing_day_returns_none(self):
+        self.assertIsNone(self.cache.get_directory())
+        self.assertIsNone(self.cache.iter_activities(self.day))
+
+    def test_get_directory_returns_saved_data(self):
+        self.cache.set_directory(HubstaffDirectory.from_users_list([
+            {'id': 1, 'name': 'Alice', 'projects': [
+                {'id': 101, 'name': 'Project A'},
+            ]},
+        ]))
+
+        directory = self.cache.get_directory(ttl=60)
+
+        self.assertDictEqual(directory.users, {1: 'Alice'})
+        self.assertDictEqual(directory.projects, {101: 'Project A'})
+
+    def test_get_directory_skips_expired_data(self):
+        self.cache.set_directory(HubstaffDirectory({1: 'Alice'}, {}))
+        filename = os.path.join(self.cache.dirname, 'directory.json')
+        os.utime(filename, (0, 0))
+
+        self.assertIsNone(self.cache.get_directory(ttl=60))
+        self.assertIsNotNone(self.cache.get_directory())
+
+    def test_set_same_directory_restarts_ttl(self):
+        self.cache.set_directory(HubstaffDirectory({1: 'Alice'}, {}))
+        filename = os.path.join(self.cache.dirname, 'directory.json')
+        os.utime(filename, (0, 0))
+
+        self.cache.set_directory(HubstaffDirectory({1: 'Alice'}, {}))
+
+        self.assertIsNotNone(self.cache.get_directory(ttl=60))
+
+    def _write_old_day(self, day, activities_list):
+        os.makedirs(self.cache.dirname, exist_ok=True)
+        with open(self.cache._get_filename(day, 'activities.jsonl'),
+                  'w') as f:
+            for activity_item in activities_list:
+                f.write(json.dumps(activity_item) + '\n')
+
+    def test_iter_activities_returns_data_of_older_version(self):
+        activities_list = [
+            {'user_id': 1, 'project_id': 101, 'tracked': 15 * 60},
+            {'user_id': 1, 'project_id': 102, 'tracked': 45 * 60},
+        ]
+        self._write_old_day(self.day, activities_list)
+
+        self.assertListEqual(list(self.cache.iter_activities(self.day)),
+                             activities_list)
+
+    def test_remove_day_removes_its_files(self):
+        self._write_old_day(self.day, [])
+        self.cache.set_incremental_state(self.day, '2001-02-03T10:00:00Z', [])
+
+        self.cache.remove_day(self.day)
+
+        self.assertIsNone(self.cache.iter_activities(self.day))
+        self.assertEqual(self.cache.get_incremental_state(self.day),
+                         (None, []))
+
+    def test_prune_incremental_states_of_previous_days(self):
+        next_day = self.day + datetime.timedelta(days=1)
+        for day in (self.day, next_day):
+            self.cache.set_incremental_state(
+                day, day.isoformat() + 'T10:00:00Z', [[1, 101, 60]])
+
+        self.cache.prune_incremental_states(next_day)
+
+        self.assertEqual(self.cache.get_incremental_state(self.day),
+                         (None, []))
+        self.assertEqual(self.cache.get_incremental_state(next_day),
+                         ('2001-02-04T10:00:00Z', [[1, 101, 60]]))
+
+    def test_interrupted_state_is_not_cached(self):
+        def cells():
+            yield [1, 101, 60]
+            raise IOError('connection lost')
+
+        with self.assertRaises(IOError):
+            self.cache.set_incremental_state(
+                self.day, '2001-02-03T10:00:00Z', cells())
+
+        self.assertEqual(self.cache.get_incremental_state(self.day),
+                         (None, []))
+        self.assertListEqual(os.listdir(self.cache.dirname), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
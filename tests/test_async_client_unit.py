@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+import asyncio
+import threading
+import time
+
+from rtbot34 import AsyncHubstaffClient
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.m_hubstaff = mock.Mock()
+        self.m_hubstaff.get_users_list.return_value = [
+            {'id': 1, 'name': 'Alice', 'projects': []},
+        ]
+        self.m_hubstaff.get_activities_list.return_value = [
+            {'user_id': 1, 'project_id': 101, 'tracked': 15 * 60},
+        ]
+
+    def test_get_users_list_calls_client(self):
+        async def fetch():
+            with AsyncHubstaffClient(self.m_hubstaff, concurrency=2) as c:
+                return await c.get_users_list(include_projects=True)
+
+        users_list = asyncio.run(fetch())
+
+        self.m_hubstaff.get_users_list.assert_called_once_with(
+            include_projects=True)
+        self.assertListEqual(users_list,
+                             self.m_hubstaff.get_users_list.return_value)
+
+    def test_get_activities_list_calls_client(self):
+        async def fetch():
+            with AsyncHubstaffClient(self.m_hubstaff, concurrency=2) as c:
+                return await c.get_activities_list(
+                    '2001-02-03', '2001-02-04', offset=500)
+
+        activities_list = asyncio.run(fetch())
+
+        self.m_hubstaff.get_activities_list.assert_called_once_with(
+            '2001-02-03', '2001-02-04', offset=500)
+        self.assertListEqual(
+            activities_list,
+            self.m_hubstaff.get_activities_list.return_value)
+
+    def test_concurrency_is_limited(self):
+        lock = threading.Lock()
+        counters = {'running': 0, 'max_running': 0}
+
+        def get_activities_list(date_from, date_to, offset=0):
+            with lock:
+                counters['running'] += 1
+                counters['max_running'] = max(
+                    counters['max_running'], counters['running'])
+            time.sleep(0.01)
+            with lock:
+                counters['running'] -= 1
+            return []
+
+        self.m_hubstaff.get_activities_list.side_effect = get_activities_list
+
+        async def fetch():
+            with AsyncHubstaffClient(self.m_hubstaff, concurrency=3) as c:
+                await asyncio.gather(*(
+                    c.get_activities_list(day, day + 1) for day in range(12)))
+
+        asyncio.run(fetch())
+
+        self.assertEqual(self.m_hubstaff.get_activities_list.call_count, 12)
+        self.assertEqual(counters['max_running'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
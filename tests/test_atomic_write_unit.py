@@ -0,0 +1,178 @@
+import unittest
+from unittest import mock
+import os
+import gzip
+import shutil
+
+import rtbot34
+from rtbot34 import atomic_write, remove_stale_copies
+
+
+class TestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dirname = '/tmp/.rtbot34write'
+        cls.filename = os.path.join(cls.dirname, 'report.html')
+
+    def setUp(self):
+        if os.path.exists(self.dirname):
+            shutil.rmtree(self.dirname)
+        os.makedirs(self.dirname)
+
+    def _read(self):
+        with open(self.filename, 'r') as f:
+            return f.read()
+
+    def test_write_new_file(self):
+        self.assertTrue(atomic_write(self.filename, iter(['<a>', '</a>'])))
+
+        self.assertEqual(self._read(), '<a></a>')
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o644)
+        self.assertListEqual(os.listdir(self.dirname), ['report.html'])
+
+    @mock.patch('rtbot34._get_umask', return_value=0o077)
+    def test_new_file_mode_follows_umask(self, m_get_umask):
+        self.assertTrue(atomic_write(self.filename, iter(['<a></a>'])))
+
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o600)
+
+    def test_new_file_gets_given_mode(self):
+        atomic_write(self.filename, iter(['<a></a>']), mode=0o600)
+
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o600)
+
+    def test_write_binary_file(self):
+        self.assertTrue(atomic_write(
+            self.filename, iter([b'\x00', b'\x01']), binary=True))
+
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), b'\x00\x01')
+
+    def test_write_big_file_in_blocks(self):
+        chunks = ['x' * 1000] * 1000
+
+        self.assertTrue(atomic_write(self.filename, iter(chunks)))
+
+        self.assertEqual(self._read(), 'x' * 1000 * 1000)
+
+    def test_skip_unchanged_file(self):
+        atomic_write(self.filename, iter(['<a>', '</a>']))
+        os.chmod(self.filename, 0o640)
+        inode = os.stat(self.filename).st_ino
+
+        self.assertFalse(atomic_write(self.filename, iter(['<a></a>'])))
+
+        self.assertEqual(os.stat(self.filename).st_ino, inode)
+        self.assertListEqual(os.listdir(self.dirname), ['report.html'])
+
+    def test_replace_changed_file_keeps_mode(self):
+        atomic_write(self.filename, iter(['<a>', '</a>']))
+        os.chmod(self.filename, 0o640)
+
+        self.assertTrue(atomic_write(self.filename, iter(['<b></b>'])))
+
+        self.assertEqual(self._read(), '<b></b>')
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o640)
+
+    def test_failed_write_keeps_old_file(self):
+        atomic_write(self.filename, iter(['<a></a>']))
+
+        def chunks():
+            yield '<b>'
+            raise IOError('render failed')
+
+        with self.assertRaises(IOError):
+            atomic_write(self.filename, chunks())
+
+        self.assertEqual(self._read(), '<a></a>')
+        self.assertListEqual(os.listdir(self.dirname), ['report.html'])
+
+    def test_write_gzip_copy(self):
+        chunks = ['<td>%s</td>' % i for i in range(10000)]
+
+        self.assertTrue(atomic_write(
+            self.filename, iter(chunks), compress=['gzip']))
+
+        with gzip.open(self.filename + '.gz', 'rt') as f:
+            self.assertEqual(f.read(), ''.join(chunks))
+        self.assertListEqual(sorted(os.listdir(self.dirname)),
+                             ['report.html', 'report.html.gz'])
+
+    def test_write_missing_gzip_copy_of_unchanged_file(self):
+        atomic_write(self.filename, iter(['<a></a>']))
+
+        self.assertFalse(atomic_write(
+            self.filename, iter(['<a></a>']), compress=['gzip']))
+
+        with gzip.open(self.filename + '.gz', 'rt') as f:
+            self.assertEqual(f.read(), '<a></a>')
+
+    @unittest.skipIf(rtbot34.brotli is None, 'brotli is not installed')
+    def test_write_brotli_copy(self):
+        atomic_write(self.filename, iter(['<a></a>']), compress=['brotli'])
+
+        with open(self.filename + '.br', 'rb') as f:
+            self.assertEqual(rtbot34.brotli.decompress(f.read()), b'<a></a>')
+
+    def test_skip_brotli_copy_if_not_installed(self):
+        with mock.patch('rtbot34.brotli', None):
+            atomic_write(self.filename, iter(['<a></a>']),
+                         compress=['gzip', 'brotli'])
+
+        self.assertListEqual(sorted(os.listdir(self.dirname)),
+                             ['report.html', 'report.html.gz'])
+
+    def test_remove_copies_which_are_not_written(self):
+        for extension in ('', '.gz', '.br'):
+            with open(self.filename + extension, 'w') as f:
+                f.write('<a></a>')
+
+        with mock.patch('rtbot34.brotli', None):
+            remove_stale_copies(self.filename, compress=['gzip', 'brotli'])
+
+        self.assertListEqual(sorted(os.listdir(self.dirname)),
+                             ['report.html', 'report.html.gz'])
+
+        remove_stale_copies(self.filename)
+
+        self.assertListEqual(os.listdir(self.dirname), ['report.html'])
+
+    def test_file_is_synced(self):
+        with mock.patch('os.fsync') as m_fsync:
+            atomic_write(self.filename, iter(['<a></a>']))
+
+        m_fsync.assert_called_once()
+
+    def test_unchanged_file_is_not_synced_nor_compressed(self):
+        atomic_write(self.filename, iter(['<a></a>']), compress=['gzip'])
+
+        with mock.patch('os.fsync') as m_fsync, \
+                mock.patch('rtbot34.zlib.compressobj') as m_compressobj:
+            self.assertFalse(atomic_write(
+                self.filename, iter(['<a></a>']), compress=['gzip']))
+
+        m_fsync.assert_not_called()
+        m_compressobj.assert_not_called()
+
+    def test_replace_file_changed_after_same_beginning(self):
+        atomic_write(self.filename, iter(['x' * 200000]), compress=['gzip'])
+        content = 'x' * 150000 + 'y' * 100000
+
+        self.assertTrue(atomic_write(
+            self.filename, iter([content]), compress=['gzip']))
+
+        self.assertEqual(self._read(), content)
+        with gzip.open(self.filename + '.gz', 'rt') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_replace_file_cut_short(self):
+        atomic_write(self.filename, iter(['<a></a><b></b>']))
+
+        self.assertTrue(atomic_write(self.filename, iter(['<a></a>'])))
+
+        self.assertEqual(self._read(), '<a></a>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists('/tmp/.rtbot34rc'):
+            os.remove('/tmp/.rtbot34rc')
+        with open('/tmp/.rtbot34rc', 'w+') as f:
+            f.write('''
+[hubstaff:first]
+app_token=AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA
+
+[hubstaff:second]
+app_token=BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB
+
+[report:third]
+html_file=/tmp/.third.html
+''')
+
+        # worker processes can't see mocks, threads can
+        patch = mock.patch('rtbot34.ProcessPoolExecutor', ThreadPoolExecutor)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch('rtbot34.handle_profile')
+        self.m_handle_profile = patch.start()
+        self.addCleanup(patch.stop)
+
+        from rtbot34 import BatchCommand
+
+        self.command = BatchCommand(
+            processes=2, config_filename='/tmp/.rtbot34rc', report_days_ago=3)
+
+    def test_handle_builds_every_profile(self):
+        self.m_handle_profile.return_value = True
+
+        results = self.command.handle()
+
+        self.assertDictEqual(results,
+                             {'first': True, 'second': True, 'third': True})
+        self.m_handle_profile.assert_has_calls([
+            mock.call({'config_filename': '/tmp/.rtbot34rc',
+                       'report_days_ago': 3, 'profile': 'first'}),
+            mock.call({'config_filename': '/tmp/.rtbot34rc',
+                       'report_days_ago': 3, 'profile': 'second'}),
+            mock.call({'config_filename': '/tmp/.rtbot34rc',
+                       'report_days_ago': 3, 'profile': 'third'}),
+        ], any_order=True)
+
+    def test_handle_collects_failures(self):
+        error = RuntimeError('disk is full')
+
+        def handle_profile(opts):
+            if opts['profile'] == 'second':
+                raise error
+            return opts['profile'] == 'first'
+
+        self.m_handle_profile.side_effect = handle_profile
+
+        results = self.command.handle()
+
+        self.assertDictEqual(results,
+                             {'first': True, 'second': False, 'third': False})
+        self.assertDictEqual(self.command.errors, {'second': error})
+
+    def test_handle_fails_without_profiles(self):
+        with open('/tmp/.rtbot34rc', 'w+') as f:
+            f.write('[hubstaff]\n')
+
+        with self.assertLogs(self.command._logger, 'ERROR'):
+            self.assertDictEqual(self.command.handle(), {})
+
+        self.m_handle_profile.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
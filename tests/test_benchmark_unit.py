@@ -0,0 +1,47 @@
+import unittest
+
+from benchmarks.bench_report import (
+    SyntheticClient, compare, run, to_relative)
+
+
+class TestCase(unittest.TestCase):
+
+    def test_synthetic_client_generates_organization(self):
+        client = SyntheticClient(users=10, projects=7, activities=600)
+
+        self.assertEqual(len(client.get_users_list()), 10)
+        self.assertEqual(len(client.get_activities_list(None, None)), 500)
+        self.assertEqual(
+            len(client.get_activities_list(None, None, offset=500)), 100)
+
+    def test_run_measures_every_stage(self):
+        results, reference = run(
+            users=10, projects=7, activities=600, days=2, repeat=1)
+
+        self.assertGreater(reference, 0)
+
+        self.assertSetEqual(set(results), {
+            'get_report_data', 'get_report_data_peak',
+            'get_report_data_cached', 'get_report_data_cached_peak',
+            'render_report_to_html', 'render_report_to_html_peak',
+            'save_report_html_to_file', 'save_report_html_to_file_peak',
+        })
+
+    def test_times_are_relative_to_reference(self):
+        self.assertDictEqual(
+            to_relative({'get_report_data': 0.5,
+                         'get_report_data_peak': 1024}, 0.25),
+            {'get_report_data': 2.0, 'get_report_data_peak': 1024})
+
+    def test_compare_returns_regressions(self):
+        regressions = compare(
+            {'render_report_to_html': 2.0, 'get_report_data': 1.0},
+            {'render_report_to_html': 1.0, 'get_report_data': 1.0},
+            tolerance=1.5)
+
+        self.assertListEqual(regressions,
+                             [('render_report_to_html', 1.0, 2.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
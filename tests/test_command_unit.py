@@ -1,9 +1,15 @@
 import unittest
 from unittest import mock
 import os
+import shutil
+import glob
+import gzip
+import json
 import logging
 import datetime
 
+from rtbot34 import ACTIVITIES_PAGE_SIZE, HubstaffAuthError, StageProfiler
+
 
 class TestCase(unittest.TestCase):
 
@@ -14,6 +20,20 @@ class TestCase(unittest.TestCase):
         if os.path.exists('/tmp/.rtbot34.html'):
             os.remove('/tmp/.rtbot34.html')
 
+        if os.path.exists('/tmp/.rtbot34.html.gz'):
+            os.remove('/tmp/.rtbot34.html.gz')
+
+        if os.path.exists('/tmp/.rtbot34cache'):
+            shutil.rmtree('/tmp/.rtbot34cache')
+
+        if os.path.exists('/tmp/.rtbot34record'):
+            shutil.rmtree('/tmp/.rtbot34record')
+
+        for filename in ('/tmp/.rtbot34.json', '/tmp/.rtbot34.prom',
+                         '/tmp/.rtbot34.csv'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
         patch = mock.patch('rtbot34.Config')
         self.m_config_class = patch.start()
         self.m_config = self.m_config_class.return_value = mock.Mock()
@@ -64,8 +84,9 @@ class TestCase(unittest.TestCase):
         self.clara_spent_time_for_project_c = 20 * 60
         self.addCleanup(patch.stop)
 
-        from rtbot34 import Command
+        from rtbot34 import Command, SpentTimeMatrix
 
+        self.matrix_class = SpentTimeMatrix
         self.command_class = Command
         self.command = self.command_class(
             config_filename='/tmp/.rtbot34rc',
@@ -82,12 +103,26 @@ class TestCase(unittest.TestCase):
         self.command._config.hubstaff_auth_token = 'B' * 43
         self.command._config.hubstaff_username = 'test@hubstaff.com'
         self.command._config.hubstaff_password = 'test123456'
+        self.command._config.hubstaff_concurrency = 4
+        self.command._config.hubstaff_rate_limit = None
+        self.command._config.hubstaff_retries = 0
+        self.command._config.hubstaff_directory_ttl = 3600
+        self.command._config.report_sort = 'name'
+        self.command._config.email_recipients = []
         self.command._config.report_filename = '/tmp/.rtbot34.html'
         self.command._config.report_date = datetime.date(2001, 2, 3)
         self.command._config.report_days_ago = 3
         self.command._config.report_date_from = datetime.date(2001, 2, 3)
         self.command._config.report_date_to = datetime.date(2001, 2, 4)
+        self.command._config.report_cache_dirname = '/tmp/.rtbot34cache'
+        self.command._config.cache_namespace = 'test'
+        self.command._config.report_incremental = False
+        self.command._config.report_stats_filename = None
+        self.command._config.report_filenames = {
+            'html': '/tmp/.rtbot34.html'}
+        self.command._config.report_compress_encodings = []
         self.command._hubstaff = self.m_hubstaff
+        self.command._load_config()
 
     def test_constructor_creates_logger(self):
         self.assertIsInstance(self.command._logger, logging.Logger)
@@ -107,10 +142,12 @@ class TestCase(unittest.TestCase):
         self.assertEqual(self.command._config, self.m_config)
 
     def test_load_config_calls_config_load_method(self):
-        self.command._load_config()
-
         self.m_config.load.assert_called_once_with()
 
+    def test_load_config_creates_activity_cache(self):
+        self.assertEqual(self.command._cache.dirname,
+                         '/tmp/.rtbot34cache/test')
+
     def test_init_client_calls_hubstaff_constructor(self):
         self.command._init_client()
 
@@ -121,12 +158,40 @@ class TestCase(unittest.TestCase):
             password='test123456',
         )
 
+    def test_init_client_uses_stored_auth_token(self):
+        self.command._init_client()
+
+        self.m_hubstaff.authenticate.assert_not_called()
+        self.assertEqual(self.command._config.hubstaff_auth_token, 'B' * 43)
+
     def test_init_client_calls_hubstaff_authenticate_method(self):
+        self.command._config.hubstaff_auth_token = None
+
         self.command._init_client()
 
         self.m_hubstaff.authenticate.assert_called_once_with()
         self.assertEqual(self.command._config.hubstaff_auth_token, 'Y' * 43)
 
+    def test_get_report_data_reauthenticates_rejected_token(self):
+        users_list = self.m_hubstaff.get_users_list.return_value
+        self.m_hubstaff.get_users_list.side_effect = [
+            HubstaffAuthError('invalid token'), users_list]
+
+        report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 4))
+
+        self.m_hubstaff_class.assert_called_once_with(
+            app_token='A' * 43,
+            auth_token=None,
+            username='test@hubstaff.com',
+            password='test123456',
+        )
+        self.m_hubstaff.authenticate.assert_called_once_with()
+        self.assertEqual(self.command._config.hubstaff_auth_token, 'Y' * 43)
+        self.assertEqual(self.m_hubstaff.get_users_list.call_count, 2)
+        self.assertEqual(report_data['users'][1]['name'], 'Alice')
+
     def test_save_config_calls_config_save_method(self):
         self.command._save_config()
 
@@ -136,6 +201,8 @@ class TestCase(unittest.TestCase):
         report_data = self.command._get_report_data(
             date_from=datetime.date(2001, 2, 3),
             date_to=datetime.date(2001, 2, 4))
+        report_data['spent_time'] = dict(report_data['spent_time'].items())
+        report_data.pop('table')
 
         self.assertDictEqual(report_data, {
             'date_from': datetime.date(2001, 2, 3),
@@ -161,7 +228,254 @@ class TestCase(unittest.TestCase):
             },
         })
 
+    def test_get_report_data_sorts_table_by_config(self):
+        self.command._config.report_sort = 'total'
+
+        report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 4))
+
+        table = report_data['table']
+        self.assertListEqual(table.users_ids, [1, 3, 2])
+        self.assertListEqual([project_id for project_id, _, _ in table.rows],
+                             [102, 103, 101])
+        self.assertListEqual(table.totals, [9000, 2400, 1200])
+        self.assertEqual(table.total, 12600)
+
+    def test_get_report_data_skips_users_and_projects_without_activity(self):
+        self.m_hubstaff.get_users_list.return_value.append(
+            {'id': 4, 'name': 'Dave', 'projects': [
+                {'id': 101, 'name': 'Project A'},
+                {'id': 104, 'name': 'Project D'},
+            ]})
+
+        report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 4))
+
+        self.assertListEqual(sorted(report_data['users']), [1, 2, 3])
+        self.assertListEqual(sorted(report_data['projects']),
+                             [101, 102, 103])
+        self.assertListEqual(report_data['spent_time'].users_ids, [1, 2, 3])
+        self.assertListEqual(report_data['spent_time'].projects_ids,
+                             [101, 102, 103])
+
+    def test_get_report_data_names_unknown_ids(self):
+        self.m_hubstaff.get_activities_list.return_value.append(
+            {'user_id': 5, 'project_id': 105, 'tracked': 60})
+
+        report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 4))
+
+        self.assertDictEqual(report_data['users'][5], {'id': 5, 'name': 5})
+        self.assertDictEqual(report_data['projects'][105],
+                             {'id': 105, 'name': 105})
+
+    def test_get_report_data_merges_date_range(self):
+        report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 6))
+
+        self.assertEqual(self.m_hubstaff.get_users_list.call_count, 1)
+        self.m_hubstaff.get_activities_list.assert_has_calls([
+            mock.call(datetime.date(2001, 2, 3), datetime.date(2001, 2, 4),
+                      offset=0),
+            mock.call(datetime.date(2001, 2, 4), datetime.date(2001, 2, 5),
+                      offset=0),
+            mock.call(datetime.date(2001, 2, 5), datetime.date(2001, 2, 6),
+                      offset=0),
+        ], any_order=True)
+        self.assertEqual(report_data['date_from'], datetime.date(2001, 2, 3))
+        self.assertEqual(report_data['date_to'], datetime.date(2001, 2, 6))
+        self.assertEqual(report_data['spent_time'].get(1, 101),
+                         3 * self.alice_spent_time_for_project_a)
+        self.assertEqual(report_data['spent_time'].get(3, 103),
+                         3 * self.clara_spent_time_for_project_c)
+
+    def test_get_report_data_fetches_activities_pages(self):
+        first_page = [
+            {'user_id': 1, 'project_id': 101, 'tracked': 1},
+        ] * ACTIVITIES_PAGE_SIZE
+        last_page = [
+            {'user_id': 2, 'project_id': 102, 'tracked': 1},
+        ]
+        self.m_hubstaff.get_activities_list.side_effect = [
+            first_page, last_page]
+
+        report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 4))
+
+        self.m_hubstaff.get_activities_list.assert_has_calls([
+            mock.call(datetime.date(2001, 2, 3), datetime.date(2001, 2, 4),
+                      offset=0),
+            mock.call(datetime.date(2001, 2, 3), datetime.date(2001, 2, 4),
+                      offset=ACTIVITIES_PAGE_SIZE),
+        ])
+        self.assertDictEqual(dict(report_data['spent_time'].items()), {
+            (1, 101): ACTIVITIES_PAGE_SIZE,
+            (2, 102): 1,
+        })
+
+    def test_get_report_data_caches_closed_day(self):
+        report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 4))
+        self.m_hubstaff.get_users_list.reset_mock()
+        self.m_hubstaff.get_activities_list.reset_mock()
+
+        cached_report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 4))
+
+        self.m_hubstaff.get_users_list.assert_not_called()
+        self.m_hubstaff.get_activities_list.assert_not_called()
+        self.assertDictEqual(dict(cached_report_data['spent_time'].items()),
+                             dict(report_data['spent_time'].items()))
+
+    def test_get_report_data_rolls_up_stored_days(self):
+        self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 3),
+            date_to=datetime.date(2001, 2, 5))
+        self.m_hubstaff.get_activities_list.reset_mock()
+        # the raw activities aren't kept for the stored days
+        self.assertListEqual(
+            sorted(os.listdir(self.command._cache.dirname)),
+            ['directory.json', 'warehouse.sqlite3'])
+
+        report_data = self.command._get_report_data(
+            date_from=datetime.date(2001, 2, 4),
+            date_to=datetime.date(2001, 2, 6))
+
+        # only the day which isn't stored yet is requested
+        self.m_hubstaff.get_activities_list.assert_called_once_with(
+            datetime.date(2001, 2, 5), datetime.date(2001, 2, 6), offset=0)
+        self.assertEqual(report_data['spent_time'].get(1, 101),
+                         2 * self.alice_spent_time_for_project_a)
+        self.assertEqual(report_data['spent_time'].total, 2 * 12600)
+
+    def test_get_report_data_stores_raw_day_of_older_version(self):
+        day = datetime.date(2001, 2, 3)
+        os.makedirs(self.command._cache.dirname)
+        with open(self.command._cache._get_filename(
+                day, 'activities.jsonl'), 'w') as f:
+            f.write(json.dumps(
+                {'user_id': 1, 'project_id': 101, 'tracked': 60}) + '\n')
+
+        report_data = self.command._get_report_data(
+            date_from=day, date_to=datetime.date(2001, 2, 4))
+
+        self.m_hubstaff.get_activities_list.assert_not_called()
+        self.assertDictEqual(dict(report_data['spent_time'].items()),
+                             {(1, 101): 60})
+        self.assertIsNone(self.command._cache.iter_activities(day))
+        self.assertSetEqual(self.command._get_warehouse().get_days(
+            day, datetime.date(2001, 2, 4)), {day})
+
+    def test_get_report_data_does_not_cache_open_day(self):
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        self.command._get_report_data(date_from=today, date_to=tomorrow)
+        self.command._get_report_data(date_from=today, date_to=tomorrow)
+
+        self.assertEqual(self.m_hubstaff.get_activities_list.call_count, 2)
+
+    def test_get_report_data_caches_directory(self):
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        self.command._get_report_data(date_from=today, date_to=tomorrow)
+        report_data = self.command._get_report_data(
+            date_from=today, date_to=tomorrow)
+
+        self.assertEqual(self.m_hubstaff.get_users_list.call_count, 1)
+        self.assertEqual(report_data['users'][1]['name'], 'Alice')
+        self.assertEqual(report_data['projects'][101]['name'], 'Project A')
+
+    def test_get_report_data_refetches_expired_directory(self):
+        self.command._config.hubstaff_directory_ttl = 0
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        self.command._get_report_data(date_from=today, date_to=tomorrow)
+        self.command._get_report_data(date_from=today, date_to=tomorrow)
+
+        self.assertEqual(self.m_hubstaff.get_users_list.call_count, 2)
+
+    def test_get_report_data_revalidates_directory_on_unknown_ids(self):
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        self.command._get_report_data(date_from=today, date_to=tomorrow)
+        self.m_hubstaff.get_users_list.return_value.append(
+            {'id': 4, 'name': 'Dave', 'projects': [
+                {'id': 104, 'name': 'Project D'},
+            ]})
+        self.m_hubstaff.get_activities_list.return_value.append(
+            {'user_id': 4, 'project_id': 104, 'tracked': 60})
+
+        report_data = self.command._get_report_data(
+            date_from=today, date_to=tomorrow)
+
+        self.assertEqual(self.m_hubstaff.get_users_list.call_count, 2)
+        self.assertEqual(report_data['users'][4]['name'], 'Dave')
+        self.assertEqual(report_data['projects'][104]['name'], 'Project D')
+
+    def test_get_report_data_fetches_only_new_activities(self):
+        self.command._config.report_incremental = True
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        day = today.isoformat()
+        self.m_hubstaff.get_activities_list.side_effect = [
+            [
+                {'user_id': 1, 'project_id': 101, 'tracked': 600,
+                 'starts_at': day + 'T10:00:00Z'},
+                {'user_id': 2, 'project_id': 101, 'tracked': 600,
+                 'starts_at': day + 'T10:00:00Z'},
+                {'user_id': 1, 'project_id': 101, 'tracked': 300,
+                 'starts_at': day + 'T10:10:00Z'},
+            ],
+            [
+                # the latest slot of the previous build has grown
+                {'user_id': 1, 'project_id': 101, 'tracked': 600,
+                 'starts_at': day + 'T10:10:00Z'},
+                {'user_id': 1, 'project_id': 102, 'tracked': 120,
+                 'starts_at': day + 'T10:20:00Z'},
+            ],
+        ]
+
+        first_data = self.command._get_report_data(
+            date_from=today, date_to=tomorrow)
+        second_data = self.command._get_report_data(
+            date_from=today, date_to=tomorrow)
+
+        self.assertDictEqual(dict(first_data['spent_time'].items()), {
+            (1, 101): 900,
+            (2, 101): 600,
+        })
+        self.assertDictEqual(dict(second_data['spent_time'].items()), {
+            (1, 101): 1200,
+            (1, 102): 120,
+            (2, 101): 600,
+        })
+        self.assertEqual(
+            self.m_hubstaff.get_activities_list.call_args_list[1],
+            mock.call(
+                datetime.datetime(today.year, today.month, today.day,
+                                  10, 10, tzinfo=datetime.timezone.utc),
+                tomorrow, offset=0))
+
     def test_render_report_to_html_returns_html(self):
+        spent_time = self.matrix_class()
+        for (user_id, project_id), seconds in {
+            (1, 101): self.alice_spent_time_for_project_a,
+            (1, 102): self.alice_spent_time_for_project_b,
+            (1, 103): self.alice_spent_time_for_project_c,
+            (2, 101): self.bob_spent_time_for_project_a,
+            (2, 102): self.bob_spent_time_for_project_b,
+            (3, 102): self.clara_spent_time_for_project_b,
+            (3, 103): self.clara_spent_time_for_project_c,
+        }.items():
+            spent_time.add(user_id, project_id, seconds)
+
         html = self.command._render_report_to_html(data={
             'date_from': datetime.date(2001, 2, 3),
             'date_to': datetime.date(2001, 2, 4),
@@ -175,15 +489,7 @@ class TestCase(unittest.TestCase):
                 102: {'id': 102, 'name': 'Project B'},
                 103: {'id': 103, 'name': 'Project C'},
             },
-            'spent_time': {
-                (1, 101): self.alice_spent_time_for_project_a,
-                (1, 102): self.alice_spent_time_for_project_b,
-                (1, 103): self.alice_spent_time_for_project_c,
-                (2, 101): self.bob_spent_time_for_project_a,
-                (2, 102): self.bob_spent_time_for_project_b,
-                (3, 102): self.clara_spent_time_for_project_b,
-                (3, 103): self.clara_spent_time_for_project_c,
-            },
+            'spent_time': spent_time,
         })
 
         self.assertEqual(html, '''<!DOCTYPE html>
@@ -206,6 +512,7 @@ class TestCase(unittest.TestCase):
         
           <th>Clara</th>
         
+          <th>Total</th>
         </tr>
       </thead>
       <tbody>
@@ -219,6 +526,7 @@ class TestCase(unittest.TestCase):
         
           <td>0</td>
         
+          <td>3000</td>
         </tr>
       
         <tr>
@@ -230,6 +538,7 @@ class TestCase(unittest.TestCase):
         
           <td>1200</td>
         
+          <td>4800</td>
         </tr>
       
         <tr>
@@ -241,13 +550,262 @@ class TestCase(unittest.TestCase):
         
           <td>1200</td>
         
+          <td>4800</td>
         </tr>
       
       </tbody>
+      <tfoot>
+        <tr>
+          <td>Total</td>
+        
+          <td>9000</td>
+        
+          <td>1200</td>
+        
+          <td>2400</td>
+        
+          <td>12600</td>
+        </tr>
+      </tfoot>
     </table>
   </body>
 </html>''')
 
+    def test_render_report_to_html_streams_chunks(self):
+        spent_time = self.matrix_class()
+        spent_time.add(1, 101, self.alice_spent_time_for_project_a)
+        data = {
+            'date_from': datetime.date(2001, 2, 3),
+            'date_to': datetime.date(2001, 2, 4),
+            'users': {1: {'id': 1, 'name': 'Alice'}},
+            'projects': {101: {'id': 101, 'name': 'Project A'}},
+            'spent_time': spent_time,
+        }
+
+        chunks = self.command._render_report_to_html(data=data, stream=True)
+
+        self.assertNotIsInstance(chunks, str)
+        self.assertEqual(''.join(chunks),
+                         self.command._render_report_to_html(data=data))
+
+    def test_render_report_to_html_compiles_template_once(self):
+        from rtbot34 import get_template
+
+        self.assertIs(get_template('report.html'),
+                      get_template('report.html'))
+
+    def test_save_report_html_to_file_writes_chunks(self):
+        self.command._save_report_html_to_file(
+            html=iter(['<html>', '</html>']), filename='/tmp/.rtbot34.html')
+
+        with open('/tmp/.rtbot34.html', 'r') as f:
+            self.assertEqual(f.read(), '<html></html>')
+
+    def test_handle_saves_config_after_report(self):
+        self.command.handle()
+
+        self.m_config.save.assert_called_once_with()
+
+    def test_handle_returns_false_on_auth_error(self):
+        self.m_config.load.side_effect = HubstaffAuthError('invalid token')
+
+        self.assertFalse(self.command.handle())
+
+    def test_serve_rebuilds_report_on_schedule(self):
+        self.m_config.load.reset_mock()
+        self.m_config.get_next_build_time.side_effect = (
+            lambda now: now + datetime.timedelta(minutes=15))
+        m_sleep = mock.Mock(side_effect=[None, KeyboardInterrupt])
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.command.serve(sleep=m_sleep)
+
+        self.m_config.load.assert_called_once_with()
+        self.m_hubstaff_class.assert_called_once()
+        self.assertEqual(self.m_config.save.call_count, 2)
+        self.assertEqual(m_sleep.call_count, 2)
+        self.assertAlmostEqual(m_sleep.call_args[0][0], 15 * 60, places=0)
+
+    def test_serve_keeps_schedule_after_failed_build(self):
+        self.m_config.get_next_build_time.side_effect = (
+            lambda now: now + datetime.timedelta(minutes=15))
+        self.m_hubstaff.get_users_list.side_effect = [
+            ConnectionError('network is down'),
+            self.m_hubstaff.get_users_list.return_value]
+        m_sleep = mock.Mock(side_effect=[None, KeyboardInterrupt])
+
+        with self.assertLogs(self.command._logger, logging.ERROR) as logs, \
+                self.assertRaises(KeyboardInterrupt):
+            self.command.serve(sleep=m_sleep)
+
+        self.assertIn('report build failed', logs.output[0])
+        self.assertEqual(m_sleep.call_count, 2)
+        self.assertTrue(os.path.exists('/tmp/.rtbot34.html'))
+
+    def test_handle_records_stats(self):
+        self.command.handle()
+
+        self.assertSetEqual(set(self.command._stats.timings), {
+            'load_config', 'init_client', 'update_report', 'fetch_users',
+            'fetch_activities', 'aggregate', 'store', 'render', 'write',
+        })
+        self.assertDictEqual(self.command._stats.counters, {
+            'requests': 2,
+            'records': 15,
+        })
+
+    def test_handle_saves_stats_json(self):
+        self.command._config.report_stats_filename = '/tmp/.rtbot34.json'
+
+        self.command.handle()
+
+        with open('/tmp/.rtbot34.json', 'r') as f:
+            stats = json.load(f)
+        self.assertEqual(stats['counters']['requests'], 2)
+        self.assertGreater(stats['timings']['update_report'], 0)
+
+    def test_handle_saves_stats_prometheus_textfile(self):
+        self.command._config.report_stats_filename = '/tmp/.rtbot34.prom'
+
+        self.command.handle()
+
+        with open('/tmp/.rtbot34.prom', 'r') as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE rtbot34_stage_seconds gauge', lines)
+        self.assertIn('rtbot34_requests 2', lines)
+        self.assertTrue(any(line.startswith(
+            'rtbot34_stage_seconds{stage="render"} ') for line in lines))
+
+    def test_handle_saves_all_report_formats(self):
+        self.command._config.report_filenames = {
+            'html': '/tmp/.rtbot34.html',
+            'csv': '/tmp/.rtbot34.csv',
+        }
+
+        self.command.handle()
+
+        self.assertEqual(self.m_hubstaff.get_users_list.call_count, 1)
+        self.assertTrue(os.path.exists('/tmp/.rtbot34.html'))
+        with open('/tmp/.rtbot34.csv', 'r') as f:
+            self.assertEqual(f.readline(), ',Alice,Bob,Clara,Total\n')
+
+    def test_build_report_skips_unchanged_report(self):
+        self.assertTrue(self.command._build_report())
+
+        self.assertFalse(self.command._build_report())
+        self.assertEqual(self.command._stats.counters['unchanged_files'], 1)
+
+    def test_build_report_emails_changed_report(self):
+        self.command._config.email_recipients = ['boss@example.com']
+        self.command._config.email_attach_gzip = True
+        self.command._mailer = mock.Mock()
+
+        self.command._build_report()
+        self.command._build_report()
+
+        with open('/tmp/.rtbot34.html', 'rb') as f:
+            html = f.read()
+        self.command._mailer.send.assert_called_once_with(
+            'rt-bot-34 report 2001-02-03 - 2001-02-04',
+            ['boss@example.com'], html, attach_gzip=True)
+
+    def test_handle_waits_for_emails(self):
+        self.command._mailer = mock.Mock()
+
+        self.command.handle()
+
+        self.command._mailer.close.assert_called_once_with()
+
+    def test_handle_replays_recorded_responses(self):
+        # the report is already built and cached before the recording
+        self.command.handle()
+        self.m_hubstaff.reset_mock()
+
+        self.command._record_dirname = '/tmp/.rtbot34record'
+        self.command.handle()
+        self.m_hubstaff.get_users_list.assert_called_once()
+        self.m_hubstaff.get_activities_list.assert_called()
+        with open('/tmp/.rtbot34.html', 'r') as f:
+            recorded_html = f.read()
+        os.remove('/tmp/.rtbot34.html')
+        self.m_hubstaff.reset_mock()
+        warehouse_filename = '/tmp/.rtbot34cache/test/warehouse.sqlite3'
+        warehouse_mtime = os.stat(warehouse_filename).st_mtime_ns
+
+        self.command._record_dirname = None
+        self.command._replay_dirname = '/tmp/.rtbot34record'
+        self.command.handle()
+
+        self.m_hubstaff.get_users_list.assert_not_called()
+        self.m_hubstaff.get_activities_list.assert_not_called()
+        with open('/tmp/.rtbot34.html', 'r') as f:
+            self.assertEqual(f.read(), recorded_html)
+        self.assertEqual(os.stat(warehouse_filename).st_mtime_ns,
+                         warehouse_mtime)
+
+    def test_handle_records_into_own_temp_cache(self):
+        os.makedirs('/tmp/.rtbot34record/cache')
+        self.command._record_dirname = '/tmp/.rtbot34record'
+
+        self.command.handle()
+
+        # the user files in the directory are kept
+        self.assertTrue(os.path.isdir('/tmp/.rtbot34record/cache'))
+        self.assertTrue(glob.glob('/tmp/.rtbot34record/test/*.json'))
+        self.assertIsNone(self.command._tmp_cache_dirname)
+        self.assertFalse(os.path.exists('/tmp/.rtbot34cache'))
+
+    def test_replay_keeps_profiles_apart(self):
+        self.command._record_dirname = '/tmp/.rtbot34record'
+        self.command.handle()
+
+        self.command._record_dirname = None
+        self.command._replay_dirname = '/tmp/.rtbot34record'
+        self.command._config.cache_namespace = 'other'
+
+        with self.assertLogs(self.command._logger, logging.ERROR):
+            self.assertFalse(self.command.handle())
+
+    def test_handle_returns_false_on_missing_recording(self):
+        self.command._replay_dirname = '/tmp/.rtbot34record'
+
+        with self.assertLogs(self.command._logger, logging.ERROR):
+            self.assertFalse(self.command.handle())
+
+    def test_handle_saves_stage_profiles(self):
+        for filename in glob.glob('/tmp/.rtbot34.*.pstats'):
+            os.remove(filename)
+        self.command._profiler = StageProfiler()
+
+        self.command.handle()
+
+        with open('/tmp/.rtbot34.profile.json', 'r') as f:
+            summary = json.load(f)
+        stages = ['load_config', 'init_client', 'update_report',
+                  'get_report_data', 'export_html']
+        self.assertSetEqual(set(summary), set(stages))
+        for stage in stages:
+            self.assertTrue(os.path.exists('/tmp/.rtbot34.%s.pstats' % stage))
+
+    def test_handle_saves_compressed_report(self):
+        self.command._config.report_compress_encodings = ['gzip']
+
+        self.command.handle()
+
+        with open('/tmp/.rtbot34.html', 'rb') as f:
+            html = f.read()
+        with gzip.open('/tmp/.rtbot34.html.gz', 'rb') as f:
+            self.assertEqual(f.read(), html)
+
+    def test_handle_removes_compressed_copy_when_compress_is_off(self):
+        self.command._config.report_compress_encodings = ['gzip']
+        self.command.handle()
+
+        self.command._config.report_compress_encodings = []
+        self.command.handle()
+
+        self.assertFalse(os.path.exists('/tmp/.rtbot34.html.gz'))
+
     def test_handle_saves_report(self):
         self.command.handle()
 
@@ -274,6 +832,7 @@ class TestCase(unittest.TestCase):
         
           <th>Clara</th>
         
+          <th>Total</th>
         </tr>
       </thead>
       <tbody>
@@ -287,6 +846,7 @@ class TestCase(unittest.TestCase):
         
           <td>0</td>
         
+          <td>3000</td>
         </tr>
       
         <tr>
@@ -298,6 +858,7 @@ class TestCase(unittest.TestCase):
         
           <td>1200</td>
         
+          <td>4800</td>
         </tr>
       
         <tr>
@@ -309,9 +870,23 @@ class TestCase(unittest.TestCase):
         
           <td>1200</td>
         
+          <td>4800</td>
         </tr>
       
       </tbody>
+      <tfoot>
+        <tr>
+          <td>Total</td>
+        
+          <td>9000</td>
+        
+          <td>1200</td>
+        
+          <td>2400</td>
+        
+          <td>12600</td>
+        </tr>
+      </tfoot>
     </table>
   </body>
 </html>''')
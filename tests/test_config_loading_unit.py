@@ -2,6 +2,8 @@ import unittest
 import os
 import datetime
 
+import marshmallow as ma
+
 from rtbot34 import Config
 
 
@@ -125,6 +127,202 @@ days_ago=2
         self.assertEqual(config.report_filename, self.default_report_filename)
         self.assertIsNone(config.report_date)
         self.assertEqual(config.report_days_ago, 1)
+        self.assertEqual(config.hubstaff_concurrency, 4)
+        self.assertEqual(config.hubstaff_rate_limit, 5.0)
+        self.assertEqual(config.hubstaff_retries, 5)
+        self.assertEqual(config.hubstaff_directory_ttl, 24 * 60 * 60)
+        self.assertFalse(config.report_incremental)
+        self.assertEqual(config.report_formats, 'html')
+        self.assertEqual(config.report_sort, 'name')
+        self.assertEqual(config.email_port, 25)
+        self.assertListEqual(config.email_recipients, [])
+        self.assertListEqual(config.report_compress_encodings, [])
+        self.assertDictEqual(config.report_filenames, {
+            'html': self.default_report_filename})
+
+    def test_report_filenames_of_formats(self):
+        config = Config(config_filename=self.config_filename,
+                        report_formats='html, csv,columnar')
+        config.load()
+
+        self.assertDictEqual(config.report_filenames, {
+            'html': '/tmp/.report.html',
+            'csv': '/tmp/.report.csv',
+            'columnar': '/tmp/.report.col',
+        })
+
+    def test_report_compress_encodings(self):
+        config = Config(config_filename=self.config_filename,
+                        report_compress='gzip, brotli')
+        config.load()
+
+        self.assertListEqual(config.report_compress_encodings,
+                             ['gzip', 'brotli'])
+
+    def test_unknown_report_compress_is_invalid(self):
+        config = Config(config_filename=self.config_filename,
+                        report_compress='zip')
+
+        with self.assertRaises(ma.ValidationError):
+            config.load()
+
+    def test_unknown_report_format_is_invalid(self):
+        config = Config(config_filename=self.config_filename,
+                        report_formats='html,pdf')
+
+        with self.assertRaises(ma.ValidationError):
+            config.load()
+
+    def test_load_boolean_var(self):
+        with open(self.tmp_config_filename, 'w+') as f:
+            f.write('[report]\nincremental = true\n')
+
+        config = Config(config_filename=self.tmp_config_filename,
+                        hubstaff_app_token='X' * 43)
+        config.load()
+
+        self.assertIs(config.report_incremental, True)
+
+    def test_false_constructor_var_is_preferred_than_conf_var(self):
+        with open(self.tmp_config_filename, 'w+') as f:
+            f.write('[report]\nincremental=true\n')
+
+        config = Config(config_filename=self.tmp_config_filename,
+                        hubstaff_app_token='X' * 43,
+                        report_incremental=False)
+        config.load()
+
+        self.assertIs(config.report_incremental, False)
+
+    def _write_profiles_config(self):
+        with open(self.tmp_config_filename, 'w+') as f:
+            f.write('''
+[hubstaff]
+app_token=MMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMM
+concurrency=8
+
+[report]
+html_file=/tmp/.report.html
+
+[hubstaff:first]
+auth_token=FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+
+[hubstaff:second]
+app_token=SSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSS
+
+[report:second]
+html_file=/tmp/.second.html
+''')
+
+    def test_list_profiles(self):
+        self._write_profiles_config()
+
+        self.assertListEqual(Config.list_profiles(self.tmp_config_filename),
+                             ['first', 'second'])
+
+    def test_profile_var_is_preferred_than_base_var(self):
+        self._write_profiles_config()
+
+        config = Config(config_filename=self.tmp_config_filename,
+                        profile='second')
+        config.load()
+
+        self.assertEqual(config.hubstaff_app_token, 'S' * 43)
+        self.assertEqual(config.hubstaff_concurrency, 8)
+        self.assertEqual(config.report_filename, '/tmp/.second.html')
+
+    def test_profile_report_filename_gets_suffix(self):
+        self._write_profiles_config()
+
+        config = Config(config_filename=self.tmp_config_filename,
+                        profile='first')
+        config.load()
+
+        self.assertEqual(config.hubstaff_app_token, 'M' * 43)
+        self.assertEqual(config.hubstaff_auth_token, 'F' * 43)
+        self.assertEqual(config.report_filename, '/tmp/.report.first.html')
+
+    def test_profiles_of_same_account_have_own_cache_namespace(self):
+        self._write_profiles_config()
+        with open(self.tmp_config_filename, 'a') as f:
+            f.write('''
+[report:third]
+html_file=/tmp/.third.html
+''')
+
+        namespaces = set()
+        for profile in (None, 'first', 'third'):
+            config = Config(config_filename=self.tmp_config_filename,
+                            hubstaff_auth_token='A' * 43, profile=profile)
+            config.load()
+            namespaces.add(config.cache_namespace)
+
+        self.assertEqual(len(namespaces), 3)
+
+    def test_report_date_to_is_next_day_by_default(self):
+        config = Config(config_filename=self.config_filename)
+        config.load()
+
+        self.assertEqual(config.report_date_from, datetime.date(2012, 3, 4))
+        self.assertEqual(config.report_date_to, datetime.date(2012, 3, 5))
+
+    def test_report_date_to_includes_range_end(self):
+        config = Config(config_filename=self.config_filename,
+                        report_date_end='2012-03-10')
+        config.load()
+
+        self.assertEqual(config.report_date_from, datetime.date(2012, 3, 4))
+        self.assertEqual(config.report_date_to, datetime.date(2012, 3, 11))
+
+    def test_next_build_time_is_daily_at_time_by_default(self):
+        config = Config(config_filename=self.config_filename)
+        config.load()
+
+        self.assertEqual(config.daemon_at, '00:10')
+        self.assertEqual(
+            config.get_next_build_time(datetime.datetime(2012, 3, 4, 0, 5)),
+            datetime.datetime(2012, 3, 4, 0, 10))
+        self.assertEqual(
+            config.get_next_build_time(datetime.datetime(2012, 3, 4, 0, 10)),
+            datetime.datetime(2012, 3, 5, 0, 10))
+
+    def test_next_build_time_with_interval(self):
+        config = Config(config_filename=self.config_filename,
+                        daemon_interval=15)
+        config.load()
+
+        self.assertEqual(
+            config.get_next_build_time(datetime.datetime(2012, 3, 4, 0, 5)),
+            datetime.datetime(2012, 3, 4, 0, 20))
+
+    def test_daemon_at_must_be_time(self):
+        config = Config(config_filename=self.config_filename,
+                        daemon_at='25:00')
+
+        with self.assertRaises(ma.ValidationError):
+            config.load()
+
+    def test_report_date_end_before_start_is_invalid(self):
+        config = Config(config_filename=self.config_filename,
+                        report_date_end='2012-03-01')
+
+        with self.assertRaises(ma.ValidationError):
+            config.load()
+
+    def test_email_recipients_without_sender_are_invalid(self):
+        config = Config(config_filename=self.config_filename,
+                        email_host='localhost', email_to='boss@example.com')
+
+        with self.assertRaises(ma.ValidationError):
+            config.load()
+
+    def test_email_username_is_sender_by_default(self):
+        config = Config(config_filename=self.config_filename,
+                        email_host='localhost', email_to='boss@example.com',
+                        email_username='bot@example.com')
+        config.load()
+
+        self.assertListEqual(config.email_recipients, ['boss@example.com'])
 
 
 if __name__ == '__main__':
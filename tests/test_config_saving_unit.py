@@ -51,14 +51,179 @@ app_token = AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA
 auth_token = BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB
 username = test@hubstaff.com
 password = test123456
+concurrency = 
+rate_limit = 
+retries = 
+directory_ttl = 
 
 [report]
 html_file = /tmp/.test.html
 date = 2001-02-03
 days_ago = 3
+cache_dir = 
+incremental = 
+stats_file = 
+formats = 
+compress = 
+sort = 
 
+[daemon]
+interval = 
+at = 
+
+[email]
+host = 
+port = 
+username = 
+password = 
+starttls = 
+from = 
+to = 
+attach_gzip = 
+
+''')
+
+    def test_new_file_is_private(self):
+        os.remove(self.config_filename)
+        config = Config(config_filename=self.config_filename,
+                        hubstaff_auth_token='B' * 43)
+        config.save()
+
+        self.assertEqual(os.stat(self.config_filename).st_mode & 0o777,
+                         0o600)
+        self.assertListEqual(
+            [name for name in os.listdir('/tmp')
+             if name.startswith('.configrc')], ['.configrc'])
+
+    def test_save_skips_unchanged_file(self):
+        config = Config(config_filename=self.config_filename)
+        config.load()
+        self.assertTrue(config.save())
+        mtime = os.stat(self.config_filename).st_mtime_ns
+
+        config = Config(config_filename=self.config_filename)
+        config.load()
+
+        self.assertFalse(config.save())
+        self.assertEqual(os.stat(self.config_filename).st_mtime_ns, mtime)
+
+    def test_save_writes_changed_value(self):
+        config = Config(config_filename=self.config_filename)
+        config.load()
+        config.save()
+
+        config.hubstaff_auth_token = 'C' * 43
+
+        self.assertTrue(config.save())
+        with open(self.config_filename) as f:
+            self.assertIn('auth_token = %s' % ('C' * 43), f.read())
+
+    def test_date_to_is_not_saved(self):
+        config = Config(config_filename=self.config_filename,
+                        report_date='2020-01-01',
+                        report_date_end='2020-01-31')
+        config.load()
+        config.save()
+
+        with open(self.config_filename) as f:
+            self.assertNotIn('date_to', f.read())
+
+        # the next runs aren't limited by the previous range end
+        config = Config(config_filename=self.config_filename,
+                        report_date='2020-03-01')
+        config.load()
+        self.assertIsNone(config.report_date_end)
+        self.assertEqual(config.report_date_to, datetime.date(2020, 3, 2))
+
+        config = Config(config_filename=self.config_filename,
+                        report_date='2020-01-10')
+        config.load()
+        self.assertEqual(config.report_date_to, datetime.date(2020, 1, 11))
+
+    def test_date_to_saved_by_older_version_is_dropped(self):
+        with open(self.config_filename, 'a') as f:
+            f.write('\ndate_to=2012-03-10\n')
+
+        config = Config(config_filename=self.config_filename)
+        config.load()
+        self.assertIsNone(config.report_date_end)
+
+        config.save()
+        with open(self.config_filename) as f:
+            self.assertNotIn('date_to', f.read())
+
+    def test_daily_time_clears_saved_interval(self):
+        config = Config(config_filename=self.config_filename,
+                        daemon_interval=5)
+        config.load()
+        config.save()
+
+        config = Config(config_filename=self.config_filename,
+                        daemon_at='08:00')
+        config.load()
+        config.save()
+        self.assertIsNone(config.daemon_interval)
+
+        config = Config(config_filename=self.config_filename)
+        config.load()
+        self.assertIsNone(config.daemon_interval)
+        self.assertEqual(config.daemon_at, '08:00')
+
+    def _write_profiles_config(self):
+        with open(self.config_filename, 'w+') as f:
+            f.write('''
+[hubstaff]
+app_token=MMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMMM
+concurrency=8
+
+[hubstaff:first]
+auth_token=FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+
+[hubstaff:second]
+auth_token=SSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSS
 ''')
 
+    def _load_profile(self, profile):
+        config = Config(config_filename=self.config_filename,
+                        profile=profile)
+        config.load()
+        return config
+
+    def test_profiles_saved_in_parallel_keep_each_other(self):
+        self._write_profiles_config()
+        first = self._load_profile('first')
+        second = self._load_profile('second')
+
+        first.hubstaff_auth_token = 'A' * 43
+        first.save()
+        second.hubstaff_auth_token = 'B' * 43
+        second.save()
+
+        self.assertEqual(self._load_profile('first').hubstaff_auth_token,
+                         'A' * 43)
+        self.assertEqual(self._load_profile('second').hubstaff_auth_token,
+                         'B' * 43)
+
+    def test_profile_saves_only_changed_values(self):
+        self._write_profiles_config()
+        config = self._load_profile('first')
+        config.hubstaff_auth_token = 'A' * 43
+        config.save()
+
+        with open(self.config_filename) as f:
+            config_text = f.read()
+        self.assertIn('''[hubstaff:first]
+auth_token = AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA
+
+''', config_text)
+        self.assertNotIn('[report:first]', config_text)
+
+        # the base values changed later still apply to the profile
+        with open(self.config_filename, 'w') as f:
+            f.write(config_text.replace('concurrency = 8',
+                                        'concurrency = 2'))
+        self.assertEqual(self._load_profile('first').hubstaff_concurrency, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import os
+import shutil
+import datetime
+
+from rtbot34 import DailyWarehouse, SpentTimeMatrix
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = '/tmp/.rtbot34warehouse'
+        if os.path.exists(self.dirname):
+            shutil.rmtree(self.dirname)
+        self.filename = os.path.join(self.dirname, 'warehouse.sqlite3')
+        self.warehouse = DailyWarehouse(self.filename)
+        self.addCleanup(lambda: self.warehouse.close())
+        for day, seconds in ((3, 60), (4, 120), (5, 180)):
+            spent_time = SpentTimeMatrix()
+            spent_time.add(1, 101, seconds)
+            spent_time.add(2, 102, 10 * seconds)
+            self.warehouse.set_day(datetime.date(2001, 2, day), spent_time)
+
+    def test_get_days_returns_stored_days_of_range(self):
+        days = self.warehouse.get_days(
+            datetime.date(2001, 2, 4), datetime.date(2001, 2, 10))
+
+        self.assertSetEqual(days, {
+            datetime.date(2001, 2, 4), datetime.date(2001, 2, 5)})
+
+    def test_rollup_sums_stored_days_of_range(self):
+        spent_time = SpentTimeMatrix()
+
+        self.warehouse.rollup(spent_time, datetime.date(2001, 2, 4),
+                              datetime.date(2001, 2, 6))
+
+        self.assertDictEqual(dict(spent_time.items()), {
+            (1, 101): 300,
+            (2, 102): 3000,
+        })
+
+    def test_set_day_replaces_stored_day(self):
+        spent_time = SpentTimeMatrix()
+        spent_time.add(3, 103, 1)
+        self.warehouse.set_day(datetime.date(2001, 2, 3), spent_time)
+        rolled_up_time = SpentTimeMatrix()
+
+        self.warehouse.rollup(rolled_up_time, datetime.date(2001, 2, 3),
+                              datetime.date(2001, 2, 4))
+
+        self.assertDictEqual(dict(rolled_up_time.items()), {(3, 103): 1})
+
+    def test_empty_day_is_stored(self):
+        self.warehouse.set_day(datetime.date(2001, 2, 6), SpentTimeMatrix())
+
+        self.assertIn(datetime.date(2001, 2, 6), self.warehouse.get_days(
+            datetime.date(2001, 2, 6), datetime.date(2001, 2, 7)))
+
+    def test_data_is_kept_in_file(self):
+        self.warehouse.close()
+        self.warehouse = DailyWarehouse(self.filename)
+
+        self.assertEqual(len(self.warehouse.get_days(
+            datetime.date(2001, 2, 1), datetime.date(2001, 3, 1))), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import io
+import json
+import datetime
+
+from rtbot34 import (
+    SpentTimeMatrix, export_csv, export_jsonl, export_columnar, load_columnar)
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        spent_time = SpentTimeMatrix()
+        spent_time.add(1, 101, 45 * 60)
+        spent_time.add(2, 101, 5 * 60)
+        spent_time.add(1, 102, 60 * 60)
+        self.data = {
+            'date_from': datetime.date(2001, 2, 3),
+            'date_to': datetime.date(2001, 2, 4),
+            'users': {
+                1: {'id': 1, 'name': 'Alice'},
+                2: {'id': 2, 'name': 'Bob, Jr.'},
+            },
+            'projects': {
+                101: {'id': 101, 'name': 'Project A'},
+                102: {'id': 102, 'name': 'Project B'},
+            },
+            'spent_time': spent_time,
+        }
+
+    def test_export_csv_returns_matrix(self):
+        csv_text = ''.join(export_csv(self.data))
+
+        self.assertEqual(csv_text, (
+            ',Alice,"Bob, Jr.",Total\r\n'
+            'Project A,2700,300,3000\r\n'
+            'Project B,3600,0,3600\r\n'
+            'Total,6300,300,6600\r\n'))
+
+    def test_export_jsonl_returns_not_empty_cells(self):
+        lines = [json.loads(line) for line in export_jsonl(self.data)]
+
+        self.assertEqual(len(lines), 3)
+        self.assertDictEqual(lines[0], {
+            'date_from': '2001-02-03',
+            'date_to': '2001-02-04',
+            'user_id': 1,
+            'user_name': 'Alice',
+            'project_id': 101,
+            'project_name': 'Project A',
+            'tracked': 2700,
+        })
+
+    def test_export_columnar_can_be_loaded(self):
+        f = io.BytesIO(b''.join(export_columnar(self.data)))
+
+        header, (users, projects, seconds) = load_columnar(f)
+
+        self.assertEqual(header['cells'], 3)
+        self.assertListEqual([user['name'] for user in header['users']],
+                             ['Alice', 'Bob, Jr.'])
+        self.assertListEqual(
+            [project['name'] for project in header['projects']],
+            ['Project A', 'Project B'])
+        self.assertListEqual(list(users), [0, 1, 0])
+        self.assertListEqual(list(projects), [0, 0, 1])
+        self.assertListEqual(list(seconds), [2700, 300, 3600])
+
+    def test_load_columnar_checks_format(self):
+        with self.assertRaises(ValueError):
+            load_columnar(io.BytesIO(b'<!DOCTYPE html>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
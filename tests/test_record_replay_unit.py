@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+import os
+import shutil
+import datetime
+
+from rtbot34 import RecordingClient, ReplayClient
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = '/tmp/.rtbot34record'
+        if os.path.exists(self.dirname):
+            shutil.rmtree(self.dirname)
+        self.m_hubstaff = mock.Mock()
+        self.m_hubstaff.get_activities_list.side_effect = (
+            lambda date_from, date_to, offset=0: [
+                {'user_id': 1, 'project_id': 101, 'tracked': offset}])
+        self.recording_client = RecordingClient(self.m_hubstaff, self.dirname)
+        self.replay_client = ReplayClient(self.dirname)
+        self.date_from = datetime.date(2001, 2, 3)
+        self.date_to = datetime.date(2001, 2, 4)
+
+    def test_replay_returns_recorded_responses(self):
+        for offset in (0, 500):
+            self.recording_client.get_activities_list(
+                self.date_from, self.date_to, offset=offset)
+
+        activities_list = self.replay_client.get_activities_list(
+            self.date_from, self.date_to, offset=500)
+
+        self.assertListEqual(activities_list, [
+            {'user_id': 1, 'project_id': 101, 'tracked': 500}])
+
+    def test_recording_client_returns_responses(self):
+        activities_list = self.recording_client.get_activities_list(
+            self.date_from, self.date_to, offset=0)
+
+        self.m_hubstaff.get_activities_list.assert_called_once_with(
+            self.date_from, self.date_to, offset=0)
+        self.assertListEqual(activities_list, [
+            {'user_id': 1, 'project_id': 101, 'tracked': 0}])
+
+    def test_replay_raises_error_for_not_recorded_request(self):
+        self.recording_client.get_activities_list(
+            self.date_from, self.date_to, offset=0)
+
+        with self.assertRaises(LookupError):
+            self.replay_client.get_activities_list(
+                self.date_from, self.date_to, offset=500)
+
+    def test_recording_client_does_not_save_auth_token(self):
+        self.m_hubstaff.authenticate.return_value = 'Y' * 43
+
+        self.assertEqual(self.recording_client.authenticate(), 'Y' * 43)
+        self.assertFalse(os.path.exists(self.dirname))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import email
+import gzip
+import socketserver
+import threading
+
+from rtbot34 import ReportMailer
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server session which keeps the received messages."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ready')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode('ascii').rstrip('\r\n')
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'RCPT':
+                recipients.append(line.partition(':')[2].strip('<> '))
+            if command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                for data_line in iter(self.rfile.readline, b'.\r\n'):
+                    # dot-stuffed lines start with an extra dot
+                    if data_line.startswith(b'..'):
+                        data_line = data_line[1:]
+                    data.append(data_line)
+                self.server.messages.append(
+                    (recipients, email.message_from_bytes(b''.join(data))))
+                recipients = []
+            self.reply('250 ok')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SMTPServer()
+        thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.mailer = ReportMailer(
+            host='127.0.0.1', port=self.server.server_address[1],
+            sender='bot@example.com')
+        self.html = b'<html><body><table></table></body></html>'
+
+    def test_send_delivers_message_to_all_recipients(self):
+        self.mailer.send('report', ['a@example.com', 'b@example.com'],
+                         self.html)
+        self.mailer.close()
+
+        self.assertListEqual(self.mailer.errors, [])
+        self.assertEqual(len(self.server.messages), 1)
+        recipients, message = self.server.messages[0]
+        self.assertListEqual(recipients, ['a@example.com', 'b@example.com'])
+        self.assertEqual(message['Subject'], 'report')
+        self.assertEqual(message['From'], 'bot@example.com')
+        self.assertEqual(message.get_content_type(), 'text/html')
+        self.assertEqual(message.get_payload(decode=True).strip(), self.html)
+
+    def test_send_reuses_connection(self):
+        for subject in ('first', 'second', 'third'):
+            self.mailer.send(subject, ['a@example.com'], self.html)
+        self.mailer.close()
+
+        self.assertEqual(self.server.connections, 1)
+        self.assertListEqual(
+            [message['Subject'] for _, message in self.server.messages],
+            ['first', 'second', 'third'])
+
+    def test_send_attaches_compressed_report(self):
+        self.mailer.send('report', ['a@example.com'], self.html,
+                         attach_gzip=True)
+        self.mailer.close()
+
+        _, message = self.server.messages[0]
+        attachments = [part for part in message.walk()
+                       if part.get_filename() == 'report.html.gz']
+        self.assertEqual(len(attachments), 1)
+        self.assertEqual(
+            gzip.decompress(attachments[0].get_payload(decode=True)),
+            self.html)
+
+    def test_send_keeps_connection_errors(self):
+        self.mailer.port = 1  # nothing listens there
+
+        self.mailer.send('report', ['a@example.com'], self.html)
+        self.mailer.close()
+
+        self.assertEqual(len(self.mailer.errors), 1)
+        self.assertIsInstance(self.mailer.errors[0], OSError)
@@ -0,0 +1,105 @@
+import unittest
+from unittest import mock
+
+from hubstaff.exceptions import HubstaffAuthError
+
+from rtbot34 import RequestScheduler, Stats
+
+
+class HttpError(Exception):
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(status_code)
+        self.response = mock.Mock(status_code=status_code,
+                                  headers=headers or {})
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.stats = Stats()
+
+    def make_scheduler(self, **kwargs):
+        return RequestScheduler(stats=self.stats, sleep=self.clock.sleep,
+                                clock=self.clock, **kwargs)
+
+    def test_burst_is_not_throttled(self):
+        scheduler = self.make_scheduler(rate=2.0, burst=3)
+
+        for _ in range(3):
+            scheduler.call(lambda: None)
+
+        self.assertListEqual(self.clock.sleeps, [])
+
+    def test_requests_over_burst_wait_for_tokens(self):
+        scheduler = self.make_scheduler(rate=2.0, burst=1)
+
+        for _ in range(3):
+            scheduler.call(lambda: None)
+
+        self.assertListEqual(self.clock.sleeps, [0.5, 0.5])
+
+    def test_unlimited_rate_is_not_throttled(self):
+        scheduler = self.make_scheduler(rate=None)
+
+        for _ in range(10):
+            scheduler.call(lambda: None)
+
+        self.assertListEqual(self.clock.sleeps, [])
+
+    def test_retry_after_header_is_honored(self):
+        func = mock.Mock(side_effect=[
+            HttpError(429, {'Retry-After': '7'}), 'ok'])
+        scheduler = self.make_scheduler(retries=3)
+
+        self.assertEqual(scheduler.call(func), 'ok')
+
+        self.assertListEqual(self.clock.sleeps, [7.0])
+        self.assertEqual(self.stats.counters['retries'], 1)
+
+    @mock.patch('rtbot34.random.uniform', side_effect=lambda a, b: b)
+    def test_server_errors_are_retried_with_backoff(self, m_uniform):
+        func = mock.Mock(side_effect=[
+            HttpError(503), ConnectionResetError(), HttpError(500), 'ok'])
+        scheduler = self.make_scheduler(retries=3)
+
+        self.assertEqual(scheduler.call(func), 'ok')
+
+        self.assertListEqual(self.clock.sleeps, [0.5, 1.0, 2.0])
+        self.assertEqual(self.stats.counters['retries'], 3)
+
+    def test_retries_are_limited(self):
+        func = mock.Mock(side_effect=HttpError(502))
+        scheduler = self.make_scheduler(retries=2)
+
+        with self.assertRaises(HttpError):
+            scheduler.call(func)
+
+        self.assertEqual(func.call_count, 3)
+
+    def test_client_errors_are_not_retried(self):
+        for error in (HttpError(404), HubstaffAuthError('expired'),
+                      ValueError()):
+            func = mock.Mock(side_effect=error)
+            scheduler = self.make_scheduler(retries=5)
+
+            with self.assertRaises(type(error)):
+                scheduler.call(func)
+
+            self.assertEqual(func.call_count, 1)
+        self.assertListEqual(self.clock.sleeps, [])
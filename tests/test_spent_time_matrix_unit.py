@@ -0,0 +1,147 @@
+import unittest
+from unittest import mock
+import random
+
+import rtbot34
+from rtbot34 import SpentTimeMatrix
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.matrix = SpentTimeMatrix()
+        self.matrix.add(1, 101, 15 * 60)
+        self.matrix.add(1, 102, 45 * 60)
+        self.matrix.add(2, 101, 5 * 60)
+        self.matrix.add(1, 101, 30 * 60)
+
+    def test_ids_are_ordered_by_first_use(self):
+        self.assertListEqual(self.matrix.users_ids, [1, 2])
+        self.assertListEqual(self.matrix.projects_ids, [101, 102])
+
+    def test_get_returns_summed_seconds(self):
+        self.assertEqual(self.matrix.get(1, 101), 45 * 60)
+        self.assertEqual(self.matrix.get(1, 102), 45 * 60)
+        self.assertEqual(self.matrix.get(2, 101), 5 * 60)
+
+    def test_get_returns_default_for_empty_cell(self):
+        self.assertEqual(self.matrix.get(2, 102), 0)
+        self.assertEqual(self.matrix.get(3, 101), 0)
+        self.assertIsNone(self.matrix.get(1, 103, default=None))
+
+    def test_iter_rows_returns_full_rows(self):
+        rows = [(project_id, list(row))
+                for project_id, row in self.matrix.iter_rows()]
+
+        self.assertListEqual(rows, [
+            (101, [45 * 60, 5 * 60]),
+            (102, [45 * 60, 0]),
+        ])
+
+    def test_iter_column_returns_user_cells(self):
+        self.assertListEqual(list(self.matrix.iter_column(2)),
+                             [(101, 5 * 60), (102, 0)])
+
+    def test_items_skips_empty_cells(self):
+        self.assertDictEqual(dict(self.matrix.items()), {
+            (1, 101): 45 * 60,
+            (1, 102): 45 * 60,
+            (2, 101): 5 * 60,
+        })
+
+    def test_update_adds_other_matrix(self):
+        other = SpentTimeMatrix()
+        other.add(3, 102, 10 * 60)
+        other.add(1, 101, 60)
+
+        self.matrix.update(other)
+
+        self.assertEqual(self.matrix.get(1, 101), 45 * 60 + 60)
+        self.assertEqual(self.matrix.get(3, 102), 10 * 60)
+
+    def test_added_ids_without_time_have_empty_cells(self):
+        self.matrix.add_user(4)
+        self.matrix.add_project(104)
+
+        self.assertListEqual(list(self.matrix.iter_column(4)),
+                             [(101, 0), (102, 0), (104, 0)])
+
+    def test_totals_are_summed_while_adding(self):
+        self.assertEqual(self.matrix.get_user_total(1), 90 * 60)
+        self.assertEqual(self.matrix.get_user_total(2), 5 * 60)
+        self.assertEqual(self.matrix.get_project_total(101), 50 * 60)
+        self.assertEqual(self.matrix.get_project_total(102), 45 * 60)
+        self.assertEqual(self.matrix.total, 95 * 60)
+
+    def test_get_table_sorts_by_name(self):
+        users = {1: {'id': 1, 'name': 'bob'}, 2: {'id': 2, 'name': 'Alice'}}
+        projects = {101: {'id': 101, 'name': 'Project B'},
+                    102: {'id': 102, 'name': 'Project A'}}
+
+        table = self.matrix.get_table(users, projects, sort_by='name')
+
+        self.assertListEqual(table.users_ids, [2, 1])
+        self.assertListEqual([(project_id, list(cells), total)
+                              for project_id, cells, total in table.rows], [
+            (102, [0, 45 * 60], 45 * 60),
+            (101, [5 * 60, 45 * 60], 50 * 60),
+        ])
+        self.assertListEqual(table.totals, [5 * 60, 90 * 60])
+        self.assertEqual(table.total, 95 * 60)
+
+    def test_get_table_sorts_by_total(self):
+        self.matrix.add(2, 102, 100 * 60)
+        users = {1: {'id': 1, 'name': 'Alice'}, 2: {'id': 2, 'name': 'Bob'}}
+        projects = {101: {'id': 101, 'name': 'Project A'},
+                    102: {'id': 102, 'name': 'Project B'}}
+
+        table = self.matrix.get_table(users, projects, sort_by='total')
+
+        self.assertListEqual(table.users_ids, [2, 1])
+        self.assertListEqual([project_id for project_id, _, _ in table.rows],
+                             [102, 101])
+        self.assertListEqual(table.totals, [105 * 60, 90 * 60])
+
+    def make_activities(self, count):
+        rnd = random.Random(34)
+        return [{'user_id': rnd.randint(1, 50),
+                 'project_id': rnd.randint(100, 120),
+                 'tracked': rnd.randint(1, 600)} for _ in range(count)]
+
+    def test_add_activities_without_numpy(self):
+        activities = self.make_activities(1000)
+        expected = {}
+        for item in activities:
+            key = item['user_id'], item['project_id']
+            expected[key] = expected.get(key, 0) + item['tracked']
+        matrix = SpentTimeMatrix()
+
+        with mock.patch('rtbot34.get_numpy', return_value=None):
+            matrix.add_activities(iter(activities))
+
+        self.assertDictEqual(dict(matrix.items()), expected)
+        self.assertEqual(matrix.total, sum(expected.values()))
+
+    @unittest.skipIf(rtbot34.get_numpy() is None, 'numpy is not installed')
+    def test_add_activities_with_numpy_matches_python_path(self):
+        activities = self.make_activities(
+            rtbot34.NUMPY_MAX_BATCH_SIZE + 1000)
+        matrix = SpentTimeMatrix()
+        python_matrix = SpentTimeMatrix()
+
+        matrix.add_activities(iter(activities))
+        with mock.patch('rtbot34.get_numpy', return_value=None):
+            python_matrix.add_activities(activities)
+
+        self.assertListEqual(matrix.users_ids, python_matrix.users_ids)
+        self.assertListEqual(matrix.projects_ids, python_matrix.projects_ids)
+        self.assertDictEqual(dict(matrix.items()),
+                             dict(python_matrix.items()))
+        self.assertEqual(matrix.total, python_matrix.total)
+        for user_id in matrix.users_ids:
+            self.assertEqual(matrix.get_user_total(user_id),
+                             python_matrix.get_user_total(user_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import os
+import glob
+import json
+import pstats
+
+from rtbot34 import StageProfiler
+
+
+def allocate(size):
+    return [bytearray(1024) for _ in range(size)]
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.prefix = '/tmp/.rtbot34profile'
+        for filename in glob.glob(self.prefix + '.*'):
+            os.remove(filename)
+        self.profiler = StageProfiler()
+
+    def test_nested_stage_is_profiled_apart(self):
+        with self.profiler.stage('outer'):
+            with self.profiler.stage('inner'):
+                data = allocate(1000)
+            del data
+
+        self.assertSetEqual(set(self.profiler.summary), {'outer', 'inner'})
+        self.assertGreater(self.profiler.summary['inner']['peak_bytes'],
+                           1000 * 1024)
+        self.assertLess(self.profiler.summary['outer']['peak_bytes'],
+                        1000 * 1024)
+        inner_functions = {
+            function for _, _, function in
+            pstats.Stats(self.profiler.profiles['inner']).stats}
+        outer_functions = {
+            function for _, _, function in
+            pstats.Stats(self.profiler.profiles['outer']).stats}
+        self.assertIn('allocate', inner_functions)
+        self.assertNotIn('allocate', outer_functions)
+
+    def test_save_writes_pstats_and_summary(self):
+        with self.profiler.stage('render'):
+            data = allocate(10)
+
+        self.profiler.save(self.prefix)
+
+        stats = pstats.Stats(self.prefix + '.render.pstats')
+        self.assertGreater(stats.total_calls, 0)
+        with open(self.prefix + '.profile.json', 'r') as f:
+            summary = json.load(f)
+        self.assertGreater(summary['render']['peak_bytes'], 10 * 1024)
+        self.assertTrue(summary['render']['top_allocations'])
+        del data
+
+
+if __name__ == '__main__':
+    unittest.main()
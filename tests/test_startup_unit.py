@@ -0,0 +1,52 @@
+import unittest
+import os
+import subprocess
+import sys
+
+import rtbot34
+
+
+class TestCase(unittest.TestCase):
+
+    def get_imported_modules(self, *args):
+        """Runs the cli with -X importtime and returns
+        the imported modules with their cumulative microseconds.
+        """
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', rtbot34.__file__] +
+            list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True,
+            cwd=os.path.dirname(rtbot34.__file__))
+        modules = {}
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+        return modules
+
+    def test_help_skips_heavy_imports(self):
+        modules = self.get_imported_modules('--help')
+
+        for name in ('jinja2', 'marshmallow', 'hubstaff', 'asyncio',
+                     'concurrent.futures', 'smtplib'):
+            self.assertNotIn(name, modules)
+
+    def test_lazy_import_keeps_dependency_in_module(self):
+        self.assertIs(rtbot34.ma, sys.modules['marshmallow'])
+        self.assertIn('ma', vars(rtbot34))
+        self.assertIs(rtbot34.ReportSectionSchema,
+                      rtbot34.get_section_schemas()['report'])
+
+    def test_all_profiles_daemon_is_rejected(self):
+        process = subprocess.run(
+            [sys.executable, rtbot34.__file__, '--all-profiles', '--daemon'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True,
+            cwd=os.path.dirname(rtbot34.__file__))
+
+        self.assertEqual(process.returncode, 2)
+        self.assertIn('--all-profiles can not be used with --daemon',
+                      process.stderr)